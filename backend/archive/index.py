@@ -0,0 +1,171 @@
+import gzip
+import hmac
+import json
+import os
+import re
+import psycopg2
+from psycopg2.extras import RealDictCursor, execute_values
+import db
+
+JOB_TOKEN = os.environ.get('ARCHIVE_JOB_TOKEN', '')
+PARTITION_SIZE = int(os.environ.get('MESSAGES_PARTITION_SIZE', '1000000'))
+PARTITIONS_AHEAD = int(os.environ.get('MESSAGES_PARTITIONS_AHEAD', '2'))
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '180'))
+ARCHIVE_CHUNK_SIZE = int(os.environ.get('ARCHIVE_CHUNK_SIZE', '500'))
+MAX_PARTITIONS_PER_RUN = int(os.environ.get('ARCHIVE_MAX_PARTITIONS_PER_RUN', '1'))
+ARCHIVED_COLUMNS = 'id, chat_id, sender_id, message_type, content, file_url, file_name, file_size, created_at'
+PARTITION_BOUND = re.compile(r'FROM \((MINVALUE|-?\d+)\) TO \((-?\d+)\)')
+
+def handler(event: dict, context) -> dict:
+    """API для обслуживания секций сообщений: создание секций впрок и архивация холодной истории"""
+    method = event.get('httpMethod', 'POST')
+    
+    if method != 'POST':
+        return response(405, {'error': 'Method not allowed'})
+    
+    headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+    if not JOB_TOKEN:
+        return response(503, {'error': 'ARCHIVE_JOB_TOKEN is not configured'})
+    if not hmac.compare_digest(headers.get('x-archive-token') or '', JOB_TOKEN):
+        return response(401, {'error': 'Invalid archive token'})
+    
+    conn = db.acquire()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    
+    try:
+        created = ensure_partitions(conn, cur)
+        archived = archive_cold_partitions(conn, cur)
+        return response(200, {'created': created, 'archived': archived})
+    
+    finally:
+        cur.close()
+        db.release(conn)
+
+def list_partitions(cur) -> list:
+    """Диапазонные секции messages по возрастанию; секция по умолчанию не входит"""
+    cur.execute("""
+        SELECT c.relname as name, pg_get_expr(c.relpartbound, c.oid) as bound
+        FROM pg_inherits i
+        INNER JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'messages'::regclass
+    """)
+    partitions = []
+    for row in cur.fetchall():
+        match = PARTITION_BOUND.search(row['bound'])
+        if match:
+            lower = None if match.group(1) == 'MINVALUE' else int(match.group(1))
+            partitions.append({'name': row['name'], 'lower': lower, 'upper': int(match.group(2))})
+    return sorted(partitions, key=lambda partition: partition['upper'])
+
+def last_message_id(cur) -> int:
+    cur.execute("SELECT last_value FROM messages_id_seq")
+    return cur.fetchone()['last_value']
+
+def ensure_partitions(conn, cur) -> list:
+    """Держит PARTITIONS_AHEAD пустых секций впереди последовательности id"""
+    last_id = last_message_id(cur)
+    partitions = list_partitions(cur)
+    upper = partitions[-1]['upper'] if partitions else 0
+    created = []
+    while upper < last_id + PARTITIONS_AHEAD * PARTITION_SIZE:
+        created.append(create_partition(cur, upper, upper + PARTITION_SIZE))
+        conn.commit()
+        upper += PARTITION_SIZE
+    return created
+
+def create_partition(cur, lower: int, upper: int) -> str:
+    """Если задание долго не запускалось и строки легли в секцию по умолчанию, переносит их в новую секцию"""
+    name = f'messages_p{lower}'
+    cur.execute("SELECT EXISTS (SELECT 1 FROM messages_default WHERE id >= %s AND id < %s) as spilled", (lower, upper))
+    if not cur.fetchone()['spilled']:
+        cur.execute(f"CREATE TABLE {name} PARTITION OF messages FOR VALUES FROM (%s) TO (%s)", (lower, upper))
+        return name
+    cur.execute("ALTER TABLE messages DETACH PARTITION messages_default")
+    cur.execute(f"CREATE TABLE {name} PARTITION OF messages FOR VALUES FROM (%s) TO (%s)", (lower, upper))
+    cur.execute(f"""
+        WITH moved AS (
+            DELETE FROM messages_default WHERE id >= %s AND id < %s RETURNING {ARCHIVED_COLUMNS}
+        )
+        INSERT INTO messages ({ARCHIVED_COLUMNS}) SELECT {ARCHIVED_COLUMNS} FROM moved
+    """, (lower, upper))
+    cur.execute("ALTER TABLE messages ATTACH PARTITION messages_default DEFAULT")
+    return name
+
+def archive_cold_partitions(conn, cur) -> list:
+    """Архивирует старейшие секции, в которых последнее сообщение старше ARCHIVE_AFTER_DAYS"""
+    last_id = last_message_id(cur)
+    archived = []
+    for partition in list_partitions(cur):
+        if partition['upper'] > last_id or len(archived) >= MAX_PARTITIONS_PER_RUN:
+            break
+        cur.execute(f"""
+            SELECT COALESCE(
+                (SELECT created_at FROM {partition['name']} ORDER BY id DESC LIMIT 1) < CURRENT_TIMESTAMP - %s * INTERVAL '1 day',
+                TRUE
+            ) as cold
+        """, (ARCHIVE_AFTER_DAYS,))
+        if not cur.fetchone()['cold']:
+            break
+        count = archive_partition(conn, cur, partition['name'])
+        cur.execute(f"ALTER TABLE messages DETACH PARTITION {partition['name']}")
+        cur.execute(f"DROP TABLE {partition['name']}")
+        conn.commit()
+        archived.append({'partition': partition['name'], 'messages': count})
+    return archived
+
+def archive_partition(conn, cur, name: str) -> int:
+    """Пишет сообщения секции в message_archive пачками по чату; идёт в той же транзакции, что и удаление секции"""
+    reader = conn.cursor(name=f'archive_{name}', cursor_factory=RealDictCursor)
+    reader.itersize = 5000
+    reader.execute(f"SELECT {ARCHIVED_COLUMNS} FROM {name} ORDER BY chat_id, id")
+    count = 0
+    chunk = []
+    pending = []
+    for row in reader:
+        if chunk and (row['chat_id'] != chunk[0]['chat_id'] or len(chunk) >= ARCHIVE_CHUNK_SIZE):
+            pending.append(pack_chunk(chunk))
+            chunk = []
+        if len(pending) >= 100:
+            write_chunks(cur, pending)
+            pending = []
+        chunk.append(dict(row))
+        count += 1
+    if chunk:
+        pending.append(pack_chunk(chunk))
+    write_chunks(cur, pending)
+    reader.close()
+    return count
+
+def pack_chunk(chunk: list) -> tuple:
+    payload = gzip.compress(json.dumps(chunk, default=isoformat, ensure_ascii=False).encode())
+    return (chunk[0]['chat_id'], chunk[0]['id'], chunk[-1]['id'], len(chunk), chunk[-1]['content'], psycopg2.Binary(payload))
+
+def isoformat(value) -> str:
+    """Даты в архиве в том же ISO 8601, что отдают обработчики для живых сообщений"""
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+def write_chunks(cur, chunks: list) -> None:
+    """Вместе с пачками поднимает chats.archived_max_id, по которому лента решает, читать ли архив"""
+    if chunks:
+        execute_values(cur, """
+            WITH archived AS (
+                INSERT INTO message_archive (chat_id, min_id, max_id, message_count, last_content, messages)
+                VALUES %s
+                ON CONFLICT (chat_id, max_id) DO NOTHING
+                RETURNING chat_id, max_id
+            )
+            UPDATE chats c SET archived_max_id = GREATEST(c.archived_max_id, a.max_id)
+            FROM (SELECT chat_id, MAX(max_id) as max_id FROM archived GROUP BY chat_id) a
+            WHERE c.id = a.chat_id
+        """, chunks)
+
+def response(status_code: int, data: dict) -> dict:
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps(data, default=str),
+        'isBase64Encoded': False
+    }
@@ -1,125 +1,101 @@
-import json
-import os
-import hashlib
 import secrets
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import passwords
+import presence
+import router
+import session
+from router import response
+
+app = router.Router('auth')
 
 def handler(event: dict, context) -> dict:
     """API для регистрации и авторизации пользователей"""
-    method = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
+    return app.handle(event)
+
+@app.route('POST', 'register', auth=False)
+def register(request, conn, cur) -> dict:
+    username = request.body.get('username', '').strip()
+    nickname = request.body.get('nickname', '').strip()
+    password = request.body.get('password', '').strip()
+    if not username or not password or not nickname:
+        return response(400, {'error': 'Username, nickname and password required'})
+    password_hash = passwords.hash_password(password)
+    invite_code = secrets.token_urlsafe(8)
     try:
-        if method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            action = body.get('action')
-            
-            if action == 'register':
-                username = body.get('username', '').strip()
-                nickname = body.get('nickname', '').strip()
-                password = body.get('password', '').strip()
-                
-                if not username or not password or not nickname:
-                    return response(400, {'error': 'Username, nickname and password required'})
-                
-                password_hash = hashlib.sha256(password.encode()).hexdigest()
-                invite_code = secrets.token_urlsafe(8)
-                
-                try:
-                    cur.execute(
-                        "INSERT INTO users (username, nickname, password_hash, invite_code, status) VALUES (%s, %s, %s, %s, 'online') RETURNING id, username, nickname, invite_code, avatar_url, status",
-                        (username, nickname, password_hash, invite_code)
-                    )
-                    user = dict(cur.fetchone())
-                    conn.commit()
-                    return response(200, {'user': user})
-                except psycopg2.IntegrityError:
-                    conn.rollback()
-                    return response(400, {'error': 'Username already exists'})
-            
-            elif action == 'login':
-                username = body.get('username', '').strip()
-                password = body.get('password', '').strip()
-                
-                if not username or not password:
-                    return response(400, {'error': 'Username and password required'})
-                
-                password_hash = hashlib.sha256(password.encode()).hexdigest()
-                
-                cur.execute(
-                    "SELECT id, username, nickname, invite_code, avatar_url, status FROM users WHERE username = %s AND password_hash = %s",
-                    (username, password_hash)
-                )
-                user = cur.fetchone()
-                
-                if not user:
-                    return response(401, {'error': 'Invalid credentials'})
-                
-                user_dict = dict(user)
-                cur.execute("UPDATE users SET status = 'online', last_seen = CURRENT_TIMESTAMP WHERE id = %s", (user_dict['id'],))
-                conn.commit()
-                
-                return response(200, {'user': user_dict})
-            
-            elif action == 'logout':
-                user_id = body.get('user_id')
-                if user_id:
-                    cur.execute("UPDATE users SET status = 'offline', last_seen = CURRENT_TIMESTAMP WHERE id = %s", (user_id,))
-                    conn.commit()
-                return response(200, {'message': 'Logged out'})
-            
-            elif action == 'update_status':
-                user_id = body.get('user_id')
-                status = body.get('status')
-                if user_id and status:
-                    cur.execute("UPDATE users SET status = %s WHERE id = %s", (status, user_id))
-                    conn.commit()
-                return response(200, {'message': 'Status updated'})
-            
-            elif action == 'update_profile':
-                user_id = body.get('user_id')
-                nickname = body.get('nickname')
-                avatar_url = body.get('avatar_url')
-                
-                if user_id and nickname:
-                    cur.execute(
-                        "UPDATE users SET nickname = %s, avatar_url = COALESCE(%s, avatar_url) WHERE id = %s RETURNING id, username, nickname, invite_code, avatar_url, status",
-                        (nickname, avatar_url, user_id)
-                    )
-                    user = dict(cur.fetchone())
-                    conn.commit()
-                    return response(200, {'user': user})
-                return response(400, {'error': 'User ID and nickname required'})
-        
-        return response(405, {'error': 'Method not allowed'})
-    
-    finally:
-        cur.close()
-        conn.close()
+        cur.execute(
+            "INSERT INTO users (username, nickname, password_hash, invite_code, status) VALUES (%s, %s, %s, %s, 'online') RETURNING id, username, nickname, invite_code, avatar_url, status",
+            (username, nickname, password_hash, invite_code)
+        )
+        user = dict(cur.fetchone())
+        presence.touch(cur, user['id'], 'online')
+        conn.commit()
+        return response(200, {'user': user, 'token': session.issue(user['id'])})
+    except psycopg2.IntegrityError:
+        conn.rollback()
+        return response(400, {'error': 'Username already exists'})
+
+@app.route('POST', 'login', auth=False)
+def login(request, conn, cur) -> dict:
+    username = request.body.get('username', '').strip()
+    password = request.body.get('password', '').strip()
+    if not username or not password:
+        return response(400, {'error': 'Username and password required'})
+    cur.execute(
+        "SELECT id, username, nickname, invite_code, avatar_url, password_hash FROM users WHERE username = %s",
+        (username,)
+    )
+    user = cur.fetchone()
+    if not user:
+        passwords.dummy_verify(password)
+        return response(401, {'error': 'Invalid credentials'})
+    if not passwords.verify_password(password, user['password_hash']):
+        return response(401, {'error': 'Invalid credentials'})
+    if passwords.needs_rehash(user['password_hash']):
+        cur.execute(
+            "UPDATE users SET password_hash = %s WHERE id = %s AND password_hash = %s",
+            (passwords.hash_password(password), user['id'], user['password_hash'])
+        )
+    user_dict = dict(user)
+    del user_dict['password_hash']
+    user_dict['status'] = 'online'
+    presence.touch(cur, user_dict['id'], 'online')
+    conn.commit()
+    return response(200, {'user': user_dict, 'token': session.issue(user_dict['id'])})
+
+@app.route('POST', 'logout')
+def logout(request, conn, cur) -> dict:
+    presence.go_offline(cur, request.user_id)
+    conn.commit()
+    return response(200, {'message': 'Logged out'})
+
+@app.route('POST', 'update_status')
+def update_status(request, conn, cur) -> dict:
+    status = request.body.get('status')
+    if status:
+        presence.touch(cur, request.user_id, status)
+        conn.commit()
+    return response(200, {'message': 'Status updated'})
+
+@app.route('POST', 'heartbeat')
+def heartbeat(request, conn, cur) -> dict:
+    presence.touch(cur, request.user_id)
+    conn.commit()
+    return response(200, {'ttl': presence.tracker.ttl})
 
-def response(status_code: int, data: dict) -> dict:
-    return {
-        'statusCode': status_code,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*'
-        },
-        'body': json.dumps(data, default=str),
-        'isBase64Encoded': False
-    }
+@app.route('POST', 'update_profile')
+def update_profile(request, conn, cur) -> dict:
+    nickname = request.body.get('nickname')
+    avatar_url = request.body.get('avatar_url')
+    if not nickname:
+        return response(400, {'error': 'User ID and nickname required'})
+    cur.execute("""
+        WITH u AS (
+            UPDATE users SET nickname = %s, avatar_url = COALESCE(%s, avatar_url) WHERE id = %s
+            RETURNING id, username, nickname, invite_code, avatar_url
+        )
+        SELECT u.*, CASE WHEN p.expires_at > CURRENT_TIMESTAMP THEN p.status ELSE 'offline' END as status
+        FROM u LEFT JOIN presence p ON p.user_id = u.id
+    """, (nickname, avatar_url, request.user_id))
+    user = dict(cur.fetchone())
+    conn.commit()
+    return response(200, {'user': user})
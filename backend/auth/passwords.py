@@ -0,0 +1,52 @@
+"""Хеширование паролей: scrypt с солью и настраиваемой стоимостью, перехеширование старых SHA-256 при входе"""
+import base64
+import hashlib
+import hmac
+import os
+
+SCRYPT_N = int(os.environ.get('PASSWORD_SCRYPT_N', str(2 ** 14)))
+SCRYPT_R = int(os.environ.get('PASSWORD_SCRYPT_R', '8'))
+SCRYPT_P = int(os.environ.get('PASSWORD_SCRYPT_P', '1'))
+SALT_BYTES = 16
+HASH_BYTES = 32
+SCHEME = 'scrypt'
+
+_dummy_hash = None
+
+
+def hash_password(password: str, n: int = SCRYPT_N, r: int = SCRYPT_R, p: int = SCRYPT_P) -> str:
+    salt = os.urandom(SALT_BYTES)
+    digest = _scrypt(password, salt, n, r, p)
+    return f'{SCHEME}${n}${r}${p}${_b64(salt)}${_b64(digest)}'
+
+
+def verify_password(password: str, stored: str) -> bool:
+    if stored.startswith(SCHEME + '$'):
+        try:
+            _, n, r, p, salt, expected = stored.split('$')
+            expected = base64.b64decode(expected)
+            digest = _scrypt(password, base64.b64decode(salt), int(n), int(r), int(p), len(expected))
+        except ValueError:
+            return False
+        return hmac.compare_digest(digest, expected)
+    return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+
+
+def needs_rehash(stored: str) -> bool:
+    return not stored.startswith(f'{SCHEME}${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$')
+
+
+def dummy_verify(password: str) -> None:
+    """Тратит столько же времени, сколько проверка настоящего хеша, чтобы не выдавать существование логина"""
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password('')
+    verify_password(password, _dummy_hash)
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int, length: int = HASH_BYTES) -> bytes:
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * r * (n + p) + 2 ** 20, dklen=length)
+
+
+def _b64(raw: bytes) -> str:
+    return base64.b64encode(raw).decode()
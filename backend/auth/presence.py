@@ -0,0 +1,67 @@
+"""Присутствие пользователей: статусы с TTL в нежурналируемой таблице presence и редкие записи users.last_seen"""
+import os
+import threading
+import time
+
+PRESENCE_TTL = int(os.environ.get('PRESENCE_TTL', '90'))
+LAST_SEEN_INTERVAL = int(os.environ.get('PRESENCE_LAST_SEEN_INTERVAL', '300'))
+
+
+class PresenceTracker:
+    """Решает, какие пульсы писать в базу; сам базу не трогает, поэтому проверяется без внешних сервисов"""
+
+    def __init__(self, ttl: int = PRESENCE_TTL, last_seen_interval: int = LAST_SEEN_INTERVAL, clock=time.time):
+        self.ttl = ttl
+        self.last_seen_interval = last_seen_interval
+        self.clock = clock
+        self._expires_at = {}
+        self._last_seen_at = {}
+        self._lock = threading.Lock()
+
+    def plan(self, user_id: int, explicit: bool) -> tuple:
+        """Возвращает (писать presence, писать last_seen); явная смена статуса пишется всегда"""
+        now = self.clock()
+        with self._lock:
+            write_presence = explicit or self._expires_at.get(user_id, 0) - now < self.ttl / 2
+            write_last_seen = explicit or now - self._last_seen_at.get(user_id, 0) >= self.last_seen_interval
+            if write_presence:
+                self._expires_at[user_id] = now + self.ttl
+            if write_last_seen:
+                self._last_seen_at[user_id] = now
+        return write_presence, write_last_seen
+
+    def forget(self, user_id: int) -> None:
+        with self._lock:
+            self._expires_at.pop(user_id, None)
+            self._last_seen_at.pop(user_id, None)
+
+
+tracker = PresenceTracker()
+
+
+def touch(cur, user_id: int, status: str = None) -> None:
+    """Пульс или смена статуса; status=None продлевает последний выбранный пользователем статус"""
+    write_presence, write_last_seen = tracker.plan(user_id, explicit=status is not None)
+    if write_presence:
+        cur.execute("""
+            INSERT INTO presence (user_id, status, expires_at)
+            VALUES (%s, COALESCE(%s, 'online'), CURRENT_TIMESTAMP + %s * INTERVAL '1 second')
+            ON CONFLICT (user_id) DO UPDATE SET
+                status = COALESCE(%s, presence.status),
+                expires_at = EXCLUDED.expires_at,
+                updated_at = CURRENT_TIMESTAMP
+        """, (user_id, status, tracker.ttl, status))
+    if write_last_seen:
+        cur.execute(
+            "UPDATE users SET last_seen = CURRENT_TIMESTAMP WHERE id = %s AND last_seen < CURRENT_TIMESTAMP - %s * INTERVAL '1 second'",
+            (user_id, 0 if status is not None else tracker.last_seen_interval)
+        )
+
+
+def go_offline(cur, user_id: int) -> None:
+    tracker.forget(user_id)
+    cur.execute("""
+        INSERT INTO presence (user_id, status, expires_at) VALUES (%s, 'offline', CURRENT_TIMESTAMP)
+        ON CONFLICT (user_id) DO UPDATE SET status = 'offline', expires_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+    """, (user_id,))
+    cur.execute("UPDATE users SET last_seen = CURRENT_TIMESTAMP WHERE id = %s", (user_id,))
@@ -1,177 +1,467 @@
+import bisect
+import gzip
+import itertools
 import json
-import os
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import cache
+import router
+import serializer
+from router import response
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_BATCH_SIZE = 100
+MAX_ID = 2 ** 31 - 1
+MAX_MESSAGE_TYPE_LENGTH = 20
+MAX_FILE_NAME_LENGTH = 255
+MESSAGE_FIELDS = """m.id, m.chat_id, m.sender_id, m.message_type, m.content, m.file_url, m.file_name, m.file_size, m.created_at,
+    u.nickname, u.avatar_url, fp.width as file_width, fp.height as file_height, fp.variants as previews"""
+
+membership_cache = cache.TTLCache()
+app = router.Router('chats', default_actions={'GET': 'list'})
 
 def handler(event: dict, context) -> dict:
     """API для управления чатами и сообщениями"""
-    method = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
+    return app.handle(event)
+
+@app.route('POST', 'create_chat')
+def create_chat(request, conn, cur) -> dict:
+    user_id = request.user_id
+    try:
+        friend_id = int(request.body.get('friend_id'))
+    except (TypeError, ValueError):
+        return response(400, {'error': 'friend_id must be an integer'})
+    if not 0 < friend_id <= MAX_ID:
+        return response(400, {'error': 'friend_id is out of range'})
+    if friend_id == user_id:
+        return response(400, {'error': 'Cannot create a chat with yourself'})
+    try:
+        chat = find_or_create_direct_chat(cur, user_id, friend_id)
+    except psycopg2.IntegrityError:
+        conn.rollback()
+        return response(404, {'error': 'User not found'})
+    conn.commit()
+    if chat['created']:
+        membership_cache.invalidate(user_id, friend_id)
+    return response(200, {'chat_id': chat['id']})
+
+@app.route('POST', 'create_group')
+def create_group(request, conn, cur) -> dict:
+    user_id = request.user_id
+    member_ids = request.body.get('member_ids', [])
+    if not isinstance(member_ids, list) or not all(
+        type(member_id) is int and 0 < member_id <= MAX_ID for member_id in member_ids
+    ):
+        return response(400, {'error': 'member_ids must be a list of user ids'})
+    try:
+        cur.execute("""
+            WITH c AS (
+                INSERT INTO chats (name, is_group) VALUES (%s, TRUE) RETURNING id
+            ), members AS (
+                INSERT INTO chat_members (chat_id, user_id)
+                SELECT c.id, member.user_id
+                FROM c, (SELECT DISTINCT unnest(%s::integer[]) as user_id) member
+                ON CONFLICT (chat_id, user_id) DO NOTHING
+            )
+            SELECT id FROM c
+        """, (request.body.get('name'), [user_id] + member_ids))
+    except psycopg2.IntegrityError:
+        conn.rollback()
+        return response(404, {'error': 'User not found'})
+    chat_id = cur.fetchone()['id']
+    conn.commit()
+    membership_cache.invalidate(user_id, *member_ids)
+    return response(200, {'chat_id': chat_id})
+
+@app.route('POST', 'send_message')
+def send_message(request, conn, cur) -> dict:
+    chat_id = request.body.get('chat_id')
+    if not is_member(cur, request.user_id, chat_id):
+        return response(403, {'error': 'Not a chat member'})
+    error = message_error(request.body)
+    if error:
+        return response(400, {'error': error})
+    messages = insert_messages(cur, chat_id, request.user_id, [request.body])
+    conn.commit()
+    return response(200, {'message': messages[0]})
+
+@app.route('POST', 'send_messages')
+def send_messages(request, conn, cur) -> dict:
+    chat_id = request.body.get('chat_id')
+    items = request.body.get('messages') or []
+    if not isinstance(items, list) or not 1 <= len(items) <= MAX_BATCH_SIZE:
+        return response(400, {'error': f'messages must be a list of 1-{MAX_BATCH_SIZE} items'})
+    error = next(filter(None, map(message_error, items)), None)
+    if error:
+        return response(400, {'error': error})
+    if not is_member(cur, request.user_id, chat_id):
+        return response(403, {'error': 'Not a chat member'})
+    messages = insert_messages(cur, chat_id, request.user_id, items)
+    conn.commit()
+    return response(200, {'messages': messages})
+
+@app.route('POST', 'mute_chat')
+def mute_chat(request, conn, cur) -> dict:
+    is_muted = request.body.get('is_muted', True)
+    cur.execute(
+        "UPDATE chat_members SET is_muted = %s WHERE chat_id = %s AND user_id = %s",
+        (is_muted, request.body.get('chat_id'), request.user_id)
+    )
+    conn.commit()
+    return response(200, {'message': 'Chat muted' if is_muted else 'Chat unmuted'})
+
+@app.route('GET', 'list')
+def list_chats(request, conn, cur) -> dict:
+    cur.execute("""
+        SELECT c.id, c.name, c.is_group, c.avatar_url, cm.is_muted,
+            GREATEST(c.message_count - cm.read_count, 0) as unread,
+            COALESCE(lm.content, la.last_content) as last_message,
+            c.last_message_at as last_message_time,
+            CASE WHEN c.is_group THEN c.name ELSE peer.nickname END as display_name,
+            peer.avatar_url as display_avatar,
+            CASE WHEN peer.expires_at > CURRENT_TIMESTAMP THEN peer.status WHEN peer.user_id IS NOT NULL THEN 'offline' END as friend_status
+        FROM chat_members cm
+        INNER JOIN chats c ON c.id = cm.chat_id
+        LEFT JOIN messages lm ON lm.id = c.last_message_id
+        LEFT JOIN LATERAL (
+            SELECT a.last_content FROM message_archive a
+            WHERE lm.id IS NULL AND a.chat_id = c.id AND a.max_id = c.last_message_id
+        ) la ON TRUE
+        LEFT JOIN LATERAL (
+            SELECT u.id as user_id, u.nickname, u.avatar_url, p.status, p.expires_at
+            FROM chat_members pm
+            INNER JOIN users u ON u.id = pm.user_id
+            LEFT JOIN presence p ON p.user_id = u.id
+            WHERE pm.chat_id = c.id AND pm.user_id != cm.user_id
+            LIMIT 1
+        ) peer ON NOT c.is_group
+        WHERE cm.user_id = %s
+        ORDER BY c.last_message_at DESC NULLS LAST, c.id DESC
+    """, (request.user_id,))
+    chats = [dict(row) for row in cur.fetchall()]
+    return page(request, {'chats': chats})
+
+@app.route('GET', 'messages')
+def list_messages(request, conn, cur) -> dict:
+    user_id = request.user_id
+    query_params = request.params
+    chat_id = query_params.get('chat_id')
+    search = query_params.get('search', '')
+    if not is_member(cur, user_id, chat_id):
+        return response(403, {'error': 'Not a chat member'})
+    if search:
+        try:
+            limit = max(1, min(int(query_params.get('limit') or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+            offset = max(0, int(query_params.get('offset') or 0))
+        except ValueError:
+            return response(400, {'error': 'limit and offset must be integers'})
+        return page(request, search_messages(cur, user_id, chat_id, search, limit, offset))
+    try:
+        before_id = int(query_params['before_id']) if query_params.get('before_id') else None
+        after_id = int(query_params['after_id']) if query_params.get('after_id') else None
+        limit = max(1, min(int(query_params.get('limit') or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+    except ValueError:
+        return response(400, {'error': 'before_id, after_id and limit must be integers'})
+    if before_id is not None and not 0 < before_id <= MAX_ID or after_id is not None and not 0 <= after_id <= MAX_ID:
+        return response(400, {'error': 'before_id and after_id are out of range'})
+    if after_id is not None:
+        cur.execute(f"""
+            SELECT {MESSAGE_FIELDS}
+            FROM messages m
+            INNER JOIN users u ON m.sender_id = u.id
+            LEFT JOIN file_previews fp ON fp.file_url = m.file_url
+            WHERE m.chat_id = %s AND m.id > %s
+            ORDER BY m.id ASC
+            LIMIT %s
+        """, (chat_id, after_id, limit + 1))
+        messages = [dict(row) for row in cur.fetchall()]
+    else:
+        cur.execute(f"""
+            SELECT c.archived_max_id, page.*
+            FROM chats c
+            LEFT JOIN LATERAL (
+                SELECT {MESSAGE_FIELDS}
+                FROM messages m
+                INNER JOIN users u ON m.sender_id = u.id
+                LEFT JOIN file_previews fp ON fp.file_url = m.file_url
+                WHERE m.chat_id = c.id AND (%s::integer IS NULL OR m.id < %s)
+                ORDER BY m.id DESC
+                LIMIT %s
+            ) page ON TRUE
+            WHERE c.id = %s
+            ORDER BY page.id DESC
+        """, (before_id, before_id, limit + 1, chat_id))
+        rows = cur.fetchall()
+        archived_max_id = rows[0]['archived_max_id'] if rows else None
+        messages = [{key: row[key] for key in row if key != 'archived_max_id'} for row in rows if row['id'] is not None]
+        if len(messages) <= limit and archived_max_id is not None:
+            oldest_id = messages[-1]['id'] if messages else before_id
+            messages += archived_messages(cur, chat_id, oldest_id, limit + 1 - len(messages))
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if after_id is None:
+        messages.reverse()
+    return page(request, {'messages': messages, 'has_more': has_more})
+
+@app.route('POST', 'mark_read')
+def mark_read(request, conn, cur) -> dict:
+    """Сдвигает маркер прочтения участника вперёд (до message_id или до конца чата) и пересчитывает read_count"""
+    chat_id = request.body.get('chat_id')
     try:
-        if method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            action = body.get('action')
-            user_id = body.get('user_id')
-            
-            if action == 'create_chat':
-                friend_id = body.get('friend_id')
-                
-                cur.execute("""
-                    SELECT c.id FROM chats c
-                    INNER JOIN chat_members cm1 ON c.id = cm1.chat_id
-                    INNER JOIN chat_members cm2 ON c.id = cm2.chat_id
-                    WHERE c.is_group = FALSE
-                    AND cm1.user_id = %s AND cm2.user_id = %s
-                """, (user_id, friend_id))
-                existing = cur.fetchone()
-                
-                if existing:
-                    return response(200, {'chat_id': existing['id']})
-                
-                cur.execute("INSERT INTO chats (is_group) VALUES (FALSE) RETURNING id")
-                chat = cur.fetchone()
-                chat_id = chat['id']
-                
-                cur.execute("INSERT INTO chat_members (chat_id, user_id) VALUES (%s, %s)", (chat_id, user_id))
-                cur.execute("INSERT INTO chat_members (chat_id, user_id) VALUES (%s, %s)", (chat_id, friend_id))
-                conn.commit()
-                
-                return response(200, {'chat_id': chat_id})
-            
-            elif action == 'create_group':
-                name = body.get('name')
-                member_ids = body.get('member_ids', [])
-                
-                cur.execute("INSERT INTO chats (name, is_group) VALUES (%s, TRUE) RETURNING id", (name,))
-                chat = cur.fetchone()
-                chat_id = chat['id']
-                
-                cur.execute("INSERT INTO chat_members (chat_id, user_id) VALUES (%s, %s)", (chat_id, user_id))
-                for member_id in member_ids:
-                    cur.execute("INSERT INTO chat_members (chat_id, user_id) VALUES (%s, %s)", (chat_id, member_id))
-                conn.commit()
-                
-                return response(200, {'chat_id': chat_id})
-            
-            elif action == 'send_message':
-                chat_id = body.get('chat_id')
-                message_type = body.get('message_type', 'text')
-                content = body.get('content')
-                file_url = body.get('file_url')
-                file_name = body.get('file_name')
-                file_size = body.get('file_size')
-                
-                cur.execute(
-                    """INSERT INTO messages (chat_id, sender_id, message_type, content, file_url, file_name, file_size)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id, created_at""",
-                    (chat_id, user_id, message_type, content, file_url, file_name, file_size)
-                )
-                message = dict(cur.fetchone())
-                conn.commit()
-                
-                return response(200, {'message': message})
-            
-            elif action == 'mute_chat':
-                chat_id = body.get('chat_id')
-                is_muted = body.get('is_muted', True)
-                
-                cur.execute(
-                    "UPDATE chat_members SET is_muted = %s WHERE chat_id = %s AND user_id = %s",
-                    (is_muted, chat_id, user_id)
-                )
-                conn.commit()
-                return response(200, {'message': 'Chat muted' if is_muted else 'Chat unmuted'})
-        
-        elif method == 'GET':
-            query_params = event.get('queryStringParameters', {}) or {}
-            user_id = query_params.get('user_id')
-            action = query_params.get('action', 'list')
-            
-            if action == 'list':
-                cur.execute("""
-                    SELECT DISTINCT c.id, c.name, c.is_group, c.avatar_url,
-                        (SELECT COUNT(*) FROM messages WHERE chat_id = c.id AND sender_id != %s 
-                         AND created_at > COALESCE((SELECT last_seen FROM users WHERE id = %s), '1970-01-01')) as unread,
-                        (SELECT content FROM messages WHERE chat_id = c.id ORDER BY created_at DESC LIMIT 1) as last_message,
-                        (SELECT created_at FROM messages WHERE chat_id = c.id ORDER BY created_at DESC LIMIT 1) as last_message_time,
-                        cm.is_muted,
-                        CASE 
-                            WHEN c.is_group THEN c.name
-                            ELSE (SELECT u.nickname FROM users u INNER JOIN chat_members cm2 ON u.id = cm2.user_id 
-                                  WHERE cm2.chat_id = c.id AND u.id != %s LIMIT 1)
-                        END as display_name,
-                        CASE 
-                            WHEN c.is_group THEN NULL
-                            ELSE (SELECT u.avatar_url FROM users u INNER JOIN chat_members cm2 ON u.id = cm2.user_id 
-                                  WHERE cm2.chat_id = c.id AND u.id != %s LIMIT 1)
-                        END as display_avatar,
-                        CASE 
-                            WHEN c.is_group THEN NULL
-                            ELSE (SELECT u.status FROM users u INNER JOIN chat_members cm2 ON u.id = cm2.user_id 
-                                  WHERE cm2.chat_id = c.id AND u.id != %s LIMIT 1)
-                        END as friend_status
-                    FROM chats c
-                    INNER JOIN chat_members cm ON c.id = cm.chat_id
-                    WHERE cm.user_id = %s
-                    ORDER BY last_message_time DESC NULLS LAST
-                """, (user_id, user_id, user_id, user_id, user_id, user_id))
-                chats = [dict(row) for row in cur.fetchall()]
-                return response(200, {'chats': chats})
-            
-            elif action == 'messages':
-                chat_id = query_params.get('chat_id')
-                search = query_params.get('search', '')
-                
-                if search:
-                    cur.execute("""
-                        SELECT m.*, u.nickname, u.avatar_url
-                        FROM messages m
-                        INNER JOIN users u ON m.sender_id = u.id
-                        WHERE m.chat_id = %s AND m.content ILIKE %s
-                        ORDER BY m.created_at DESC
-                        LIMIT 50
-                    """, (chat_id, f'%{search}%'))
-                else:
-                    cur.execute("""
-                        SELECT m.*, u.nickname, u.avatar_url
-                        FROM messages m
-                        INNER JOIN users u ON m.sender_id = u.id
-                        WHERE m.chat_id = %s
-                        ORDER BY m.created_at ASC
-                    """, (chat_id,))
-                
-                messages = [dict(row) for row in cur.fetchall()]
-                return response(200, {'messages': messages})
-        
-        return response(405, {'error': 'Method not allowed'})
-    
-    finally:
-        cur.close()
-        conn.close()
-
-def response(status_code: int, data: dict) -> dict:
-    return {
-        'statusCode': status_code,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*'
-        },
-        'body': json.dumps(data, default=str),
-        'isBase64Encoded': False
-    }
+        message_id = int(request.body['message_id']) if request.body.get('message_id') is not None else None
+    except (TypeError, ValueError):
+        return response(400, {'error': 'message_id must be an integer'})
+    if message_id is not None and not 0 < message_id <= MAX_ID:
+        return response(400, {'error': 'message_id is out of range'})
+    if not is_member(cur, request.user_id, chat_id):
+        return response(403, {'error': 'Not a chat member'})
+    cur.execute("""
+        WITH target AS (
+            SELECT id as chat_id, message_count, LEAST(COALESCE(%(message_id)s, last_message_id), last_message_id) as id
+            FROM chats WHERE id = %(chat_id)s AND last_message_id IS NOT NULL
+        )
+        UPDATE chat_members cm
+        SET last_read_message_id = target.id,
+            read_count = target.message_count
+                - (SELECT COUNT(*) FROM messages m
+                   WHERE m.chat_id = target.chat_id AND m.id > target.id AND m.sender_id != %(user_id)s)
+                - COALESCE((SELECT SUM(a.message_count) FROM message_archive a
+                   WHERE a.chat_id = target.chat_id AND a.min_id > target.id), 0)
+        FROM target
+        WHERE cm.chat_id = target.chat_id AND cm.user_id = %(user_id)s AND cm.last_read_message_id < target.id
+        RETURNING cm.last_read_message_id, GREATEST(target.message_count - cm.read_count, 0) as unread
+    """, {'chat_id': int(chat_id), 'user_id': request.user_id, 'message_id': message_id})
+    marker = cur.fetchone()
+    if marker is None:
+        cur.execute("""
+            SELECT cm.last_read_message_id, GREATEST(c.message_count - cm.read_count, 0) as unread
+            FROM chat_members cm INNER JOIN chats c ON c.id = cm.chat_id
+            WHERE cm.chat_id = %s AND cm.user_id = %s
+        """, (int(chat_id), request.user_id))
+        marker = cur.fetchone()
+    conn.commit()
+    return response(200, dict(marker))
+
+@app.route('GET', 'receipts')
+def receipts(request, conn, cur) -> dict:
+    """Сколько участников прочли каждое сообщение страницы, не считая отправителя. Маркеры группируются
+    в базе, поэтому в Python приходит по строке на позицию маркера, а не на каждого участника группы"""
+    chat_id = request.params.get('chat_id')
+    try:
+        message_ids = [int(value) for value in (request.params.get('message_ids') or '').split(',') if value]
+    except ValueError:
+        return response(400, {'error': 'message_ids must be comma-separated integers'})
+    if not all(0 < message_id <= MAX_ID for message_id in message_ids):
+        return response(400, {'error': 'message_ids are out of range'})
+    if not 1 <= len(message_ids) <= MAX_PAGE_SIZE:
+        return response(400, {'error': f'message_ids must list 1-{MAX_PAGE_SIZE} ids'})
+    if not is_member(cur, request.user_id, chat_id):
+        return response(403, {'error': 'Not a chat member'})
+    cur.execute(
+        "SELECT id, sender_id FROM messages WHERE chat_id = %s AND id = ANY(%s) ORDER BY id",
+        (int(chat_id), message_ids)
+    )
+    messages = cur.fetchall()
+    if not messages:
+        return page(request, {'receipts': []})
+    cur.execute("""
+        SELECT last_read_message_id, COUNT(*) as members, array_agg(user_id) FILTER (WHERE user_id = ANY(%s)) as senders
+        FROM chat_members
+        WHERE chat_id = %s AND last_read_message_id >= %s
+        GROUP BY last_read_message_id
+    """, (list({message['sender_id'] for message in messages}), int(chat_id), messages[0]['id']))
+    markers = sorted(cur.fetchall(), key=lambda row: row['last_read_message_id'])
+    positions = [row['last_read_message_id'] for row in markers]
+    read_from = list(itertools.accumulate(row['members'] for row in reversed(markers)))[::-1] + [0]
+    sender_markers = {user_id: row['last_read_message_id'] for row in markers for user_id in row['senders'] or ()}
+    result = []
+    for message in messages:
+        read_count = read_from[bisect.bisect_left(positions, message['id'])]
+        if sender_markers.get(message['sender_id'], 0) >= message['id']:
+            read_count -= 1
+        result.append({'message_id': message['id'], 'read_count': read_count})
+    return page(request, {'receipts': result})
+
+@app.route('GET', 'search')
+def search(request, conn, cur) -> dict:
+    search = request.params.get('search', '').strip()
+    if not search:
+        return response(400, {'error': 'search required'})
+    try:
+        limit = max(1, min(int(request.params.get('limit') or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+        offset = max(0, int(request.params.get('offset') or 0))
+    except ValueError:
+        return response(400, {'error': 'limit and offset must be integers'})
+    return page(request, search_messages(cur, request.user_id, None, search, limit, offset))
+
+@app.route('GET', 'cache_stats', with_db=False)
+def cache_stats(request) -> dict:
+    return response(200, membership_cache.stats())
+
+def is_member(cur, user_id: int, chat_id) -> bool:
+    """Членство берём из кеша; промах перепроверяем в базе, ведь чат мог появиться на другом экземпляре"""
+    try:
+        chat_id = int(chat_id)
+    except (TypeError, ValueError):
+        return False
+    chat_ids, hit = membership_cache.get_or_load(user_id, lambda: load_chat_ids(cur, user_id))
+    if chat_id not in chat_ids and hit:
+        membership_cache.invalidate(user_id)
+        chat_ids, _ = membership_cache.get_or_load(user_id, lambda: load_chat_ids(cur, user_id))
+    return chat_id in chat_ids
+
+def load_chat_ids(cur, user_id: int) -> frozenset:
+    cur.execute("SELECT chat_id FROM chat_members WHERE user_id = %s", (user_id,))
+    return frozenset(row['chat_id'] for row in cur.fetchall())
+
+def find_or_create_direct_chat(cur, user_id: int, friend_id: int) -> dict:
+    """Личный чат ищется по ключу (min_user_id, max_user_id) и создаётся тем же запросом, если его нет;
+    если параллельный вызов успел вставить ту же пару, повторный запрос уже видит его чат"""
+    params = {'min_user_id': min(user_id, friend_id), 'max_user_id': max(user_id, friend_id)}
+    for _ in range(2):
+        cur.execute("""
+            WITH existing AS (
+                SELECT id FROM chats WHERE min_user_id = %(min_user_id)s AND max_user_id = %(max_user_id)s
+            ), inserted AS (
+                INSERT INTO chats (is_group, min_user_id, max_user_id)
+                SELECT FALSE, %(min_user_id)s, %(max_user_id)s
+                WHERE NOT EXISTS (SELECT 1 FROM existing)
+                ON CONFLICT (min_user_id, max_user_id) DO NOTHING
+                RETURNING id
+            ), members AS (
+                INSERT INTO chat_members (chat_id, user_id)
+                SELECT inserted.id, member.user_id
+                FROM inserted, unnest(ARRAY[%(min_user_id)s, %(max_user_id)s]) member(user_id)
+            )
+            SELECT id, FALSE as created FROM existing
+            UNION ALL
+            SELECT id, TRUE as created FROM inserted
+        """, params)
+        chat = cur.fetchone()
+        if chat:
+            return chat
+    raise RuntimeError('Direct chat was neither found nor created')
+
+def archived_messages(cur, chat_id, before_id, count: int) -> list:
+    """Продолжение ленты из message_archive, когда живые секции кончились; новые сообщения первыми.
+    Вызывается только для чатов с chats.archived_max_id, то есть с уже архивированной историей"""
+    messages = []
+    while len(messages) < count:
+        cur.execute("""
+            SELECT min_id, messages FROM message_archive
+            WHERE chat_id = %s AND (%s::integer IS NULL OR min_id < %s)
+            ORDER BY max_id DESC
+            LIMIT 1
+        """, (chat_id, before_id, before_id))
+        chunk = cur.fetchone()
+        if not chunk:
+            break
+        rows = json.loads(gzip.decompress(bytes(chunk['messages'])))
+        messages += [row for row in reversed(rows) if before_id is None or row['id'] < before_id][:count - len(messages)]
+        before_id = chunk['min_id']
+    if not messages:
+        return messages
+    cur.execute("""
+        SELECT u.id, u.nickname, u.avatar_url FROM users u WHERE u.id = ANY(%s)
+    """, (list({row['sender_id'] for row in messages}),))
+    senders = {row['id']: row for row in cur.fetchall()}
+    cur.execute("""
+        SELECT file_url, width, height, variants FROM file_previews WHERE file_url = ANY(%s)
+    """, (list({row['file_url'] for row in messages if row['file_url']}),))
+    previews = {row['file_url']: row for row in cur.fetchall()}
+    for row in messages:
+        sender = senders.get(row['sender_id']) or {}
+        preview = previews.get(row['file_url']) or {}
+        row.update(
+            nickname=sender.get('nickname'), avatar_url=sender.get('avatar_url'),
+            file_width=preview.get('width'), file_height=preview.get('height'), previews=preview.get('variants')
+        )
+    return messages
+
+def message_error(item) -> str:
+    """Текст ошибки для сообщения, которое не ляжет в колонки messages, или пустая строка"""
+    if not isinstance(item, dict):
+        return 'each message must be an object'
+    message_type = item.get('message_type', 'text')
+    if not isinstance(message_type, str) or not 0 < len(message_type) <= MAX_MESSAGE_TYPE_LENGTH:
+        return f'message_type must be a string of 1-{MAX_MESSAGE_TYPE_LENGTH} characters'
+    for field in ('content', 'file_url', 'file_name'):
+        value = item.get(field)
+        if value is not None and (not isinstance(value, str) or '\x00' in value):
+            return f'{field} must be a string'
+    if item.get('file_name') is not None and len(item['file_name']) > MAX_FILE_NAME_LENGTH:
+        return f'file_name must be at most {MAX_FILE_NAME_LENGTH} characters'
+    file_size = item.get('file_size')
+    if file_size is not None and (type(file_size) is not int or not 0 <= file_size <= MAX_ID):
+        return 'file_size must be a non-negative integer'
+    return ''
+
+def insert_messages(cur, chat_id, user_id, items: list) -> list:
+    """Вставляет пачку сообщений одним запросом и обновляет сводку чата, маркер прочтения отправителя и NOTIFY.
+    Счётчик сообщений растёт только в строке chats, поэтому запись не зависит от размера группы"""
+    cur.execute("""
+        WITH m AS (
+            INSERT INTO messages (chat_id, sender_id, message_type, content, file_url, file_name, file_size)
+            SELECT %s, %s, t.message_type, t.content, t.file_url, t.file_name, t.file_size
+            FROM unnest(%s::varchar[], %s::text[], %s::text[], %s::varchar[], %s::integer[])
+                WITH ORDINALITY t(message_type, content, file_url, file_name, file_size, n)
+            ORDER BY t.n
+            RETURNING id, chat_id, sender_id, created_at
+        ), latest AS (
+            SELECT chat_id, sender_id, MAX(id) as id, MAX(created_at) as created_at, COUNT(*) as n
+            FROM m GROUP BY chat_id, sender_id
+        ), summary AS (
+            UPDATE chats SET message_count = chats.message_count + latest.n,
+                last_message_id = GREATEST(chats.last_message_id, latest.id),
+                last_message_at = CASE WHEN chats.last_message_id IS NULL OR chats.last_message_id < latest.id
+                    THEN latest.created_at ELSE chats.last_message_at END
+            FROM latest
+            WHERE chats.id = latest.chat_id
+            RETURNING chats.id, chats.message_count
+        ), marker AS (
+            UPDATE chat_members SET last_read_message_id = GREATEST(chat_members.last_read_message_id, latest.id),
+                read_count = summary.message_count
+            FROM latest
+            INNER JOIN summary ON summary.id = latest.chat_id
+            WHERE chat_members.chat_id = latest.chat_id AND chat_members.user_id = latest.sender_id
+        )
+        SELECT m.id, m.created_at FROM m, latest
+        CROSS JOIN LATERAL pg_notify('chat_' || latest.chat_id, latest.id::text) notified
+        ORDER BY m.id
+    """, (
+        chat_id, user_id,
+        [item.get('message_type', 'text') for item in items],
+        [item.get('content') for item in items],
+        [item.get('file_url') for item in items],
+        [item.get('file_name') for item in items],
+        [item.get('file_size') for item in items],
+    ))
+    return [dict(row) for row in cur.fetchall()]
+
+def search_messages(cur, user_id, chat_id, search: str, limit: int, offset: int) -> dict:
+    """Полнотекстовый поиск по чатам пользователя (или по одному чату) с ранжированием и подсветкой.
+    В highlight текст сообщения экранирован как HTML, разметкой остаются только <mark> вокруг совпадений"""
+    cur.execute(f"""
+        SELECT {MESSAGE_FIELDS}, hit.rank,
+            ts_headline('russian', replace(replace(replace(replace(replace(m.content,
+                    '&', '&amp;'), '<', '&lt;'), '>', '&gt;'), '"', '&quot;'), '''', '&#39;'), hit.query,
+                'StartSel=<mark>, StopSel=</mark>, MaxFragments=2, MaxWords=20, MinWords=5') as highlight
+        FROM (
+            SELECT m.id, q.query, ts_rank_cd(m.content_tsv, q.query) as rank
+            FROM websearch_to_tsquery('russian', %s) q(query)
+            INNER JOIN messages m ON m.content_tsv @@ q.query
+            INNER JOIN chat_members cm ON cm.chat_id = m.chat_id AND cm.user_id = %s
+            WHERE %s::integer IS NULL OR m.chat_id = %s
+            ORDER BY rank DESC, m.id DESC
+            LIMIT %s OFFSET %s
+        ) hit
+        INNER JOIN messages m ON m.id = hit.id
+        INNER JOIN users u ON m.sender_id = u.id
+        LEFT JOIN file_previews fp ON fp.file_url = m.file_url
+        ORDER BY hit.rank DESC, m.id DESC
+    """, (search, user_id, chat_id, chat_id, limit + 1, offset))
+    messages = [dict(row) for row in cur.fetchall()]
+    return {'messages': messages[:limit], 'has_more': len(messages) > limit}
+
+def page(request, data: dict) -> dict:
+    return response(200, serializer.compact(data) if request.params.get('format') == 'compact' else data)
@@ -0,0 +1,80 @@
+import os
+import select
+import time
+import router
+import serializer
+from router import response
+
+MAX_WAIT = float(os.environ.get('EVENTS_MAX_WAIT', '25'))
+MAX_MESSAGES = 200
+MESSAGE_FIELDS = """m.id, m.chat_id, m.sender_id, m.message_type, m.content, m.file_url, m.file_name, m.file_size, m.created_at,
+    u.nickname, u.avatar_url, fp.width as file_width, fp.height as file_height, fp.variants as previews"""
+
+app = router.Router('events', default_actions={'GET': 'poll'})
+
+def handler(event: dict, context) -> dict:
+    """API для доставки новых сообщений через long-poll"""
+    return app.handle(event)
+
+@app.route('GET', 'poll')
+def poll(request, conn, cur) -> dict:
+    user_id = request.user_id
+    try:
+        after_id = int(request.params['after_id']) if request.params.get('after_id') else None
+        wait = max(0.0, min(float(request.params.get('timeout') or MAX_WAIT), MAX_WAIT))
+    except ValueError:
+        return response(400, {'error': 'after_id and timeout must be numbers'})
+    if after_id is None:
+        cur.execute("""
+            SELECT COALESCE(MAX(c.last_message_id), 0) as cursor
+            FROM chat_members cm
+            INNER JOIN chats c ON c.id = cm.chat_id
+            WHERE cm.user_id = %s
+        """, (user_id,))
+        return response(200, {'messages': [], 'cursor': cur.fetchone()['cursor'], 'has_more': False})
+    messages = fetch_new_messages(cur, user_id, after_id)
+    if not messages and wait > 0:
+        cur.execute("SELECT chat_id FROM chat_members WHERE user_id = %s", (user_id,))
+        channels = [f"chat_{row['chat_id']}" for row in cur.fetchall()]
+        conn.rollback()
+        if channels:
+            conn.autocommit = True
+            try:
+                cur.execute(';'.join(f'LISTEN {channel}' for channel in channels))
+                messages = fetch_new_messages(cur, user_id, after_id)
+                if not messages and wait_for_notify(conn, wait):
+                    messages = fetch_new_messages(cur, user_id, after_id)
+            finally:
+                cur.execute('UNLISTEN *')
+                conn.autocommit = False
+    has_more = len(messages) > MAX_MESSAGES
+    messages = messages[:MAX_MESSAGES]
+    cursor = messages[-1]['id'] if messages else after_id
+    data = {'messages': messages, 'cursor': cursor, 'has_more': has_more}
+    return response(200, serializer.compact(data) if request.params.get('format') == 'compact' else data)
+
+def fetch_new_messages(cur, user_id: int, after_id: int) -> list:
+    cur.execute(f"""
+        SELECT {MESSAGE_FIELDS}
+        FROM chat_members cm
+        INNER JOIN messages m ON m.chat_id = cm.chat_id AND m.id > %s
+        INNER JOIN users u ON m.sender_id = u.id
+        LEFT JOIN file_previews fp ON fp.file_url = m.file_url
+        WHERE cm.user_id = %s
+        ORDER BY m.id ASC
+        LIMIT %s
+    """, (after_id, user_id, MAX_MESSAGES + 1))
+    return [dict(row) for row in cur.fetchall()]
+
+def wait_for_notify(conn, wait: float) -> bool:
+    deadline = time.monotonic() + wait
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        if select.select([conn], [], [], remaining) == ([], [], []):
+            return False
+        conn.poll()
+        if conn.notifies:
+            conn.notifies.clear()
+            return True
@@ -0,0 +1,139 @@
+"""Общий каркас обработчиков: CORS и OPTIONS, таблица действий, соединение из пула и JSON-ответы"""
+import importlib.util
+import json
+import sys
+import time
+import db
+import metrics
+import serializer
+import session
+
+ALLOW_HEADERS = ('Content-Type', 'X-User-Id', 'X-Session-Token', 'Authorization')
+JSON_HEADERS = {
+    'Content-Type': 'application/json',
+    'Access-Control-Allow-Origin': '*',
+    'Vary': 'Accept-Encoding'
+}
+ENCODED_HEADERS = {encoding: {**JSON_HEADERS, 'Content-Encoding': encoding} for encoding in serializer.ENCODINGS}
+
+
+class Request:
+    """То, что действие знает о запросе: тело POST, параметры строки запроса и пользователь сессии"""
+    __slots__ = ('event', 'method', 'action', 'params', 'body', 'user_id')
+
+    def __init__(self, event: dict, method: str, action, params: dict, body: dict, user_id):
+        self.event = event
+        self.method = method
+        self.action = action
+        self.params = params
+        self.body = body
+        self.user_id = user_id
+
+
+class Router:
+    """Таблица (метод, action) -> действие. Действие с with_db получает (request, conn, cur) с курсором
+    metrics.Cursor и соединением, которое вернётся в пул; без with_db — только request"""
+
+    def __init__(self, function: str, default_actions: dict = None, extra_headers: tuple = (), errors_as_json: bool = False):
+        self.function = function
+        self.default_actions = default_actions or {}
+        self.errors_as_json = errors_as_json
+        self.routes = {}
+        self.methods = set()
+        self.extra_headers = extra_headers
+        self.options = None
+
+    def route(self, method: str, action: str, auth: bool = True, with_db: bool = True):
+        def register(view):
+            self.routes[(method, action)] = (view, auth, with_db)
+            self.methods.add(method)
+            self.options = options_response(self.methods, ALLOW_HEADERS + self.extra_headers)
+            return view
+        return register
+
+    def handle(self, event: dict) -> dict:
+        metrics.start(self.function)
+        serializer.accept(event)
+        method = event.get('httpMethod', 'GET')
+        if method == 'OPTIONS':
+            return self.options
+        params = event.get('queryStringParameters') or {}
+        if params.get('action') == 'metrics':
+            return metrics.scrape(event)
+        if method not in self.methods:
+            return response(405, {'error': 'Method not allowed'})
+        try:
+            body = json.loads(event.get('body') or '{}') if method == 'POST' else {}
+        except ValueError:
+            return response(400, {'error': 'Invalid JSON body'})
+        if not isinstance(body, dict):
+            return response(400, {'error': 'JSON body must be an object'})
+        action = (body if method == 'POST' else params).get('action') or self.default_actions.get(method)
+        metrics.action(action)
+        route = self.routes.get((method, action))
+        if route is None:
+            return response(400, {'error': 'Unknown action'})
+        view, auth, with_db = route
+        user_id = session.user_id_from(event)
+        if auth and user_id is None:
+            return response(401, {'error': 'Invalid or expired session'})
+        request = Request(event, method, action, params, body, user_id)
+        try:
+            if not with_db:
+                return view(request)
+            conn = db.acquire()
+            cur = conn.cursor(cursor_factory=metrics.Cursor)
+            try:
+                return view(request, conn, cur)
+            finally:
+                cur.close()
+                db.release(conn)
+        except Exception as e:
+            if not self.errors_as_json:
+                metrics.finish(500, 0, 0.0)
+                raise
+            return response(500, {'error': str(e)})
+
+
+def options_response(methods, allow_headers) -> dict:
+    """Ответ на preflight не зависит от запроса, поэтому собирается один раз при регистрации действий"""
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': ', '.join(sorted(methods) + ['OPTIONS']),
+            'Access-Control-Allow-Headers': ', '.join(allow_headers),
+            'Access-Control-Max-Age': '86400'
+        },
+        'body': '',
+        'isBase64Encoded': False
+    }
+
+
+def response(status_code: int, data: dict) -> dict:
+    started = time.perf_counter()
+    body, encoding, size = serializer.encode(serializer.dumps(data))
+    metrics.finish(status_code, size, time.perf_counter() - started)
+    return {
+        'statusCode': status_code,
+        'headers': ENCODED_HEADERS[encoding] if encoding else JSON_HEADERS,
+        'body': body,
+        'isBase64Encoded': encoding is not None
+    }
+
+
+def lazy(name: str):
+    """Модуль, который выполнится при первом обращении к его атрибуту: тяжёлые зависимости
+    вроде boto3 и Pillow не удлиняют холодный старт действий, которым они не нужны"""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    parent, _, child = name.rpartition('.')
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,92 @@
+"""Сериализация ответов: orjson с нативными датами, сжатие gzip/brotli по Accept-Encoding и компактный формат списков"""
+import base64
+import gzip
+import os
+import threading
+import brotli
+import orjson
+
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', '4'))
+ENCODINGS = ('br', 'gzip')
+PROFILE_FIELDS = ('nickname', 'avatar_url')
+
+_local = threading.local()
+
+
+def accept(event: dict) -> None:
+    """Вызывается в начале handler: запоминает лучшее сжатие, которое принимает клиент текущего запроса"""
+    headers = event.get('headers') or {}
+    header = next((value for key, value in headers.items() if key.lower() == 'accept-encoding'), '')
+    _local.encoding = negotiate(header or '')
+
+
+def negotiate(header: str):
+    """Кодировка с наибольшим q из поддерживаемых; при равных q — по порядку ENCODINGS"""
+    weights = {}
+    for part in header.split(','):
+        name, _, params = part.partition(';')
+        weight = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name.strip().lower()] = weight
+    best, best_weight = None, 0.0
+    for encoding in ENCODINGS:
+        weight = weights.get(encoding, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def dumps(data) -> bytes:
+    """datetime и date orjson пишет сам в ISO 8601; default=str остаётся для Decimal и прочих редких типов"""
+    return orjson.dumps(data, default=str)
+
+
+def encode(raw: bytes) -> tuple:
+    """(body, encoding, size): тело сжимается, если клиент это принимает и ответ не меньше COMPRESS_MIN_BYTES;
+    сжатое тело отдаётся платформе в base64, size — байты, которые уйдут клиенту"""
+    encoding = getattr(_local, 'encoding', None)
+    if encoding is None or len(raw) < COMPRESS_MIN_BYTES:
+        return raw.decode(), None, len(raw)
+    if encoding == 'br':
+        compressed = brotli.compress(raw, quality=BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(raw, compresslevel=GZIP_LEVEL, mtime=0)
+    return base64.b64encode(compressed).decode(), encoding, len(compressed)
+
+
+def compact(data: dict) -> dict:
+    """Ответ для format=compact: списки строк уходят колонками, а профили отправителей сообщений —
+    один раз на страницу в users вместо копии в каждом сообщении"""
+    result = {'format': 'compact'}
+    for key, value in data.items():
+        if key == 'messages' and isinstance(value, list):
+            result[key], result['users'] = compact_messages(value)
+        elif isinstance(value, list):
+            result[key] = table(value)
+        else:
+            result[key] = value
+    return result
+
+
+def table(rows: list) -> dict:
+    columns = list(rows[0]) if rows else []
+    return {'columns': columns, 'rows': [[row.get(column) for column in columns] for row in rows]}
+
+
+def compact_messages(messages: list) -> tuple:
+    columns = [key for key in messages[0] if key not in PROFILE_FIELDS] if messages else []
+    users = {}
+    rows = []
+    for message in messages:
+        sender_id = str(message['sender_id'])
+        if sender_id not in users:
+            users[sender_id] = {field: message.get(field) for field in PROFILE_FIELDS}
+        rows.append([message.get(column) for column in columns])
+    return {'columns': columns, 'rows': rows}, users
@@ -1,74 +1,312 @@
-import json
 import os
 import base64
-import boto3
+import hashlib
+from collections import OrderedDict
 from datetime import datetime
+from psycopg2.extras import Json
+import router
+from router import response
+
+boto3 = router.lazy('boto3')
+botocore_config = router.lazy('botocore.config')
+botocore_exceptions = router.lazy('botocore.exceptions')
+pil_image = router.lazy('PIL.Image')
+thumbnails = router.lazy('thumbnails')
+
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL', 'https://bucket.poehali.dev')
+S3_BUCKET = os.environ.get('S3_BUCKET', 'files')
+KEY_PREFIX = 'moonly/'
+PART_SIZE = max(int(os.environ.get('S3_PART_SIZE', str(5 * 1024 * 1024))), 5 * 1024 * 1024)
+PRESIGN_EXPIRES = int(os.environ.get('S3_PRESIGN_EXPIRES', '900'))
+KNOWN_OBJECTS_LIMIT = 10000
+MAX_PREVIEW_SOURCE_SIZE = int(os.environ.get('MAX_PREVIEW_SOURCE_SIZE', str(40 * 1024 * 1024)))
+
+_s3 = None
+_known_objects = OrderedDict()
+app = router.Router('files', default_actions={'POST': 'upload'}, errors_as_json=True)
 
 def handler(event: dict, context) -> dict:
     """API для загрузки файлов и изображений"""
-    method = event.get('httpMethod', 'POST')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    if method != 'POST':
-        return response(405, {'error': 'Method not allowed'})
-    
+    return app.handle(event)
+
+@app.route('POST', 'upload', with_db=False)
+def upload(request) -> dict:
+    file_name = request.body.get('file_name')
+    file_data = request.body.get('file_data')
+    if not file_data or not file_name:
+        return response(400, {'error': 'file_data and file_name required'})
+    key, file_size = upload_base64(s3_client(), file_data, request.body.get('file_type', 'application/octet-stream'))
+    return response(200, {
+        'file_url': public_url(key),
+        'file_name': file_name,
+        'file_size': file_size
+    })
+
+@app.route('POST', 'presign', with_db=False)
+def presign(request) -> dict:
+    file_name = request.body.get('file_name')
+    file_type = request.body.get('file_type', 'application/octet-stream')
+    if not file_name:
+        return response(400, {'error': 'file_name required'})
+    s3 = s3_client()
+    digest = request.body.get('sha256')
+    params = {'Bucket': S3_BUCKET, 'ContentType': file_type}
+    headers = {'Content-Type': file_type}
+    if digest:
+        if not is_sha256_hex(digest):
+            return response(400, {'error': 'sha256 must be a hex digest'})
+        key = content_key(digest)
+        file_size = object_size(s3, key)
+        if file_size is not None:
+            return response(200, {'exists': True, 'file_url': public_url(key), 'file_name': file_name, 'file_size': file_size})
+        checksum = base64.b64encode(bytes.fromhex(digest)).decode()
+        params['ChecksumSHA256'] = checksum
+        headers['x-amz-checksum-sha256'] = checksum
+    else:
+        key = new_key(file_name)
+    upload_url = s3.generate_presigned_url(
+        'put_object',
+        Params={**params, 'Key': key},
+        ExpiresIn=PRESIGN_EXPIRES
+    )
+    return response(200, {
+        'exists': False,
+        'upload_url': upload_url,
+        'headers': headers,
+        'file_url': public_url(key),
+        'file_name': file_name
+    })
+
+@app.route('POST', 'multipart_start', with_db=False)
+def multipart_start(request) -> dict:
+    file_name = request.body.get('file_name')
+    if not file_name:
+        return response(400, {'error': 'file_name required'})
+    s3 = s3_client()
+    digest = request.body.get('sha256')
+    if digest and not is_sha256_hex(digest):
+        return response(400, {'error': 'sha256 must be a hex digest'})
+    if digest:
+        file_size = object_size(s3, content_key(digest))
+        if file_size is not None:
+            return response(200, {'exists': True, 'file_url': public_url(content_key(digest)), 'file_name': file_name, 'file_size': file_size})
+    key = new_key(file_name)
+    upload = s3.create_multipart_upload(
+        Bucket=S3_BUCKET, Key=key, ContentType=request.body.get('file_type', 'application/octet-stream')
+    )
+    return response(200, {'exists': False, 'upload_id': upload['UploadId'], 'key': key, 'part_size': PART_SIZE})
+
+@app.route('POST', 'previews')
+def previews(request, conn, cur) -> dict:
+    file_url = request.body.get('file_url', '')
+    key = key_from_url(file_url)
+    if not key:
+        return response(400, {'error': 'file_url of an uploaded file required'})
+    result = get_or_create_previews(conn, cur, s3_client(), file_url, key)
+    if result is None:
+        return response(400, {'error': 'File is not a supported image'})
+    return response(200, result)
+
+@app.route('POST', 'multipart_part', with_db=False)
+def multipart_part(request) -> dict:
+    key, upload_id = multipart_upload(request.body)
+    if not key:
+        return response(400, {'error': 'key and upload_id required'})
+    part_number = part_number_from(request.body.get('part_number'))
+    file_data = request.body.get('file_data')
+    if part_number is None or not file_data:
+        return response(400, {'error': 'part_number (1-10000) and file_data required'})
     try:
-        body = json.loads(event.get('body', '{}'))
-        file_data = body.get('file_data')
-        file_name = body.get('file_name')
-        file_type = body.get('file_type', 'application/octet-stream')
-        
-        if not file_data or not file_name:
-            return response(400, {'error': 'file_data and file_name required'})
-        
-        file_bytes = base64.b64decode(file_data)
-        
-        s3 = boto3.client('s3',
-            endpoint_url='https://bucket.poehali.dev',
+        chunk = base64.b64decode(file_data, validate=True)
+    except (TypeError, ValueError):
+        return response(400, {'error': 'file_data must be base64'})
+    part = s3_client().upload_part(
+        Bucket=S3_BUCKET, Key=key, UploadId=upload_id,
+        PartNumber=part_number, Body=chunk
+    )
+    return response(200, {'part_number': part_number, 'etag': part['ETag'], 'size': len(chunk)})
+
+@app.route('POST', 'multipart_complete', with_db=False)
+def multipart_complete(request) -> dict:
+    key, upload_id = multipart_upload(request.body)
+    if not key:
+        return response(400, {'error': 'key and upload_id required'})
+    parts = request.body.get('parts')
+    if not isinstance(parts, list) or not parts or not all(
+        isinstance(part, dict) and part_number_from(part.get('part_number')) and isinstance(part.get('etag'), str) and part['etag']
+        for part in parts
+    ):
+        return response(400, {'error': 'parts must be a non-empty list of {part_number, etag}'})
+    parts = sorted(({'PartNumber': part_number_from(part['part_number']), 'ETag': part['etag']} for part in parts),
+                   key=lambda part: part['PartNumber'])
+    s3 = s3_client()
+    s3.complete_multipart_upload(
+        Bucket=S3_BUCKET, Key=key, UploadId=upload_id,
+        MultipartUpload={'Parts': parts}
+    )
+    head = s3.head_object(Bucket=S3_BUCKET, Key=key)
+    return response(200, {
+        'file_url': public_url(key),
+        'file_name': request.body.get('file_name'),
+        'file_size': head['ContentLength']
+    })
+
+@app.route('POST', 'multipart_abort', with_db=False)
+def multipart_abort(request) -> dict:
+    key, upload_id = multipart_upload(request.body)
+    if not key:
+        return response(400, {'error': 'key and upload_id required'})
+    s3_client().abort_multipart_upload(Bucket=S3_BUCKET, Key=key, UploadId=upload_id)
+    return response(200, {'message': 'Upload aborted'})
+
+def multipart_upload(body: dict) -> tuple:
+    """(key, upload_id) незавершённой загрузки из тела запроса или (None, None), если они неверны"""
+    key = body.get('key', '')
+    upload_id = body.get('upload_id')
+    if not isinstance(key, str) or not key.startswith(KEY_PREFIX) or not isinstance(upload_id, str) or not upload_id:
+        return None, None
+    return key, upload_id
+
+def part_number_from(value):
+    """Номер части 1-10000 из тела запроса (число или строка из цифр) или None"""
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        return None
+    return number if 1 <= number <= 10000 else None
+
+def s3_client():
+    global _s3
+    if _s3 is None:
+        _s3 = boto3.client('s3',
+            endpoint_url=S3_ENDPOINT_URL,
             aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
             aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
+            config=botocore_config.Config(signature_version='s3v4'),
         )
-        
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        key = f'moonly/{timestamp}_{file_name}'
-        
+    return _s3
+
+def new_key(file_name: str) -> str:
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return f'{KEY_PREFIX}{timestamp}_{file_name}'
+
+def content_key(digest: str) -> str:
+    return f'{KEY_PREFIX}sha256/{digest.lower()}'
+
+def is_sha256_hex(value) -> bool:
+    return isinstance(value, str) and len(value) == 64 and all(c in '0123456789abcdefABCDEF' for c in value)
+
+def object_size(s3, key: str):
+    """Размер объекта, если он уже есть в бакете: сперва локальный индекс контейнера, затем HEAD"""
+    if key in _known_objects:
+        _known_objects.move_to_end(key)
+        return _known_objects[key]
+    try:
+        head = s3.head_object(Bucket=S3_BUCKET, Key=key)
+    except botocore_exceptions.ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+    remember_object(key, head['ContentLength'])
+    return head['ContentLength']
+
+def remember_object(key: str, file_size: int) -> None:
+    _known_objects[key] = file_size
+    _known_objects.move_to_end(key)
+    if len(_known_objects) > KNOWN_OBJECTS_LIMIT:
+        _known_objects.popitem(last=False)
+
+def public_url(key: str) -> str:
+    return f'{public_url_base()}/{key}'
+
+def public_url_base() -> str:
+    return os.environ.get('S3_PUBLIC_URL', f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket")
+
+def key_from_url(file_url: str):
+    prefix = f'{public_url_base()}/{KEY_PREFIX}'
+    if not file_url.startswith(prefix):
+        return None
+    return file_url[len(prefix) - len(KEY_PREFIX):]
+
+def get_or_create_previews(conn, cur, s3, file_url: str, key: str):
+    """Уменьшенные копии картинки: берутся из file_previews или строятся и сохраняются один раз на файл"""
+    cur.execute("SELECT width, height, variants FROM file_previews WHERE file_url = %s", (file_url,))
+    existing = cur.fetchone()
+    if existing:
+        return dict(existing)
+    
+    original = s3.get_object(Bucket=S3_BUCKET, Key=key, Range=f'bytes=0-{MAX_PREVIEW_SOURCE_SIZE - 1}')
+    if original['ContentLength'] >= MAX_PREVIEW_SOURCE_SIZE:
+        return None
+    try:
+        result = thumbnails.make_previews(original['Body'].read())
+    except (pil_image.UnidentifiedImageError, pil_image.DecompressionBombError, OSError):
+        return None
+    
+    variants = []
+    for variant in result['variants']:
+        variant_key = f"{KEY_PREFIX}previews/{key[len(KEY_PREFIX):]}/{variant['name']}.{variant['format']}"
         s3.put_object(
-            Bucket='files',
-            Key=key,
-            Body=file_bytes,
-            ContentType=file_type
+            Bucket=S3_BUCKET, Key=variant_key, Body=variant['data'],
+            ContentType=f"image/{variant['format']}", CacheControl='public, max-age=31536000, immutable'
         )
-        
-        file_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{key}"
-        
-        return response(200, {
-            'file_url': file_url,
-            'file_name': file_name,
-            'file_size': len(file_bytes)
+        variants.append({
+            'name': variant['name'],
+            'format': variant['format'],
+            'width': variant['width'],
+            'height': variant['height'],
+            'url': public_url(variant_key)
         })
     
-    except Exception as e:
-        return response(500, {'error': str(e)})
-
-def response(status_code: int, data: dict) -> dict:
-    return {
-        'statusCode': status_code,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*'
-        },
-        'body': json.dumps(data),
-        'isBase64Encoded': False
-    }
+    cur.execute(
+        """INSERT INTO file_previews (file_url, width, height, variants) VALUES (%s, %s, %s, %s)
+        ON CONFLICT (file_url) DO NOTHING""",
+        (file_url, result['width'], result['height'], Json(variants))
+    )
+    conn.commit()
+    return {'width': result['width'], 'height': result['height'], 'variants': variants}
+
+def upload_base64(s3, file_data: str, file_type: str) -> tuple:
+    """Кладёт файл под ключ по SHA-256 содержимого и пропускает запись, если такой объект уже есть"""
+    part_bytes = PART_SIZE + (-PART_SIZE % 3)
+    chunk_chars = part_bytes // 3 * 4
+    
+    if len(file_data) <= chunk_chars:
+        file_bytes = base64.b64decode(file_data)
+        key = content_key(hashlib.sha256(file_bytes).hexdigest())
+        if object_size(s3, key) is None:
+            s3.put_object(Bucket=S3_BUCKET, Key=key, Body=file_bytes, ContentType=file_type)
+            remember_object(key, len(file_bytes))
+        return key, len(file_bytes)
+    
+    offsets = range(0, len(file_data), chunk_chars)
+    digest = hashlib.sha256()
+    file_size = 0
+    for offset in offsets:
+        chunk = base64.b64decode(file_data[offset:offset + chunk_chars])
+        digest.update(chunk)
+        file_size += len(chunk)
+    key = content_key(digest.hexdigest())
+    if object_size(s3, key) is not None:
+        return key, file_size
+    
+    upload_id = s3.create_multipart_upload(Bucket=S3_BUCKET, Key=key, ContentType=file_type)['UploadId']
+    parts = []
+    try:
+        for part_number, offset in enumerate(offsets, start=1):
+            part = s3.upload_part(
+                Bucket=S3_BUCKET, Key=key, UploadId=upload_id,
+                PartNumber=part_number, Body=base64.b64decode(file_data[offset:offset + chunk_chars])
+            )
+            parts.append({'PartNumber': part_number, 'ETag': part['ETag']})
+        s3.complete_multipart_upload(
+            Bucket=S3_BUCKET, Key=key, UploadId=upload_id,
+            MultipartUpload={'Parts': parts}
+        )
+    except Exception:
+        s3.abort_multipart_upload(Bucket=S3_BUCKET, Key=key, UploadId=upload_id)
+        raise
+    remember_object(key, file_size)
+    return key, file_size
@@ -0,0 +1,48 @@
+"""Уменьшенные копии изображений для ленты сообщений"""
+import io
+from PIL import Image, ImageOps
+
+PREVIEW_SIZES = (('medium', 1280), ('thumb', 320))
+PREVIEW_FORMATS = (('webp', 'WEBP', {'quality': 80, 'method': 4}), ('jpeg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}))
+MAX_SOURCE_PIXELS = 50_000_000
+ORIENTATION_TAG = 0x0112
+
+Image.MAX_IMAGE_PIXELS = MAX_SOURCE_PIXELS
+
+
+def make_previews(data: bytes) -> dict:
+    """Возвращает размеры оригинала и варианты от большего к меньшему; больше оригинала не увеличивает"""
+    with Image.open(io.BytesIO(data)) as image:
+        width, height = image.size
+        if image.getexif().get(ORIENTATION_TAG) in (5, 6, 7, 8):
+            width, height = height, width
+        image.draft('RGB', (PREVIEW_SIZES[0][1], PREVIEW_SIZES[0][1]))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+
+        variants = []
+        for name, size in PREVIEW_SIZES:
+            if size >= max(width, height) and name != PREVIEW_SIZES[-1][0]:
+                continue
+            if size < max(image.size):
+                image = image.resize(_fit(image.size, size), Image.LANCZOS, reducing_gap=2.0)
+            for extension, pil_format, options in PREVIEW_FORMATS:
+                frame = image.convert('RGB') if pil_format == 'JPEG' and image.mode != 'RGB' else image
+                buffer = io.BytesIO()
+                frame.save(buffer, pil_format, **options)
+                variants.append({
+                    'name': name,
+                    'format': extension,
+                    'width': image.width,
+                    'height': image.height,
+                    'data': buffer.getvalue()
+                })
+
+    return {'width': width, 'height': height, 'variants': variants}
+
+
+def _fit(size: tuple, longest: int) -> tuple:
+    width, height = size
+    scale = longest / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
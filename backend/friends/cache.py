@@ -0,0 +1,88 @@
+"""Кеш в памяти экземпляра функции: LRU с TTL, явная инвалидация, счётчики попаданий и ETag"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_MAX_SIZE = int(os.environ.get('CACHE_MAX_SIZE', '1024'))
+CACHE_TTL = float(os.environ.get('CACHE_TTL', '15'))
+
+
+class TTLCache:
+    """Другие экземпляры функции инвалидацию не видят, поэтому устаревание ограничено TTL"""
+
+    def __init__(self, max_size: int = CACHE_MAX_SIZE, ttl: float = CACHE_TTL, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._items = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[1] > self.clock():
+                self._items.move_to_end(key)
+                self.hits += 1
+                return item[0]
+            if item is not None:
+                del self._items[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, generation: int = None) -> None:
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._items[key] = (value, self.clock() + self.ttl)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, load) -> tuple:
+        """Возвращает (значение, было ли попадание); загрузка, пересёкшаяся с инвалидацией, в кеш не попадает"""
+        value = self.get(key)
+        if value is not None:
+            return value, True
+        generation = self._generation
+        value = load()
+        self.put(key, value, generation)
+        return value, False
+
+    def invalidate(self, *keys) -> None:
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                if self._items.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._items),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+def etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def not_modified(event: dict, tag: str) -> bool:
+    headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+    candidates = (value.strip() for value in (headers.get('if-none-match') or '').split(','))
+    return any(value == '*' or value.removeprefix('W/') == tag for value in candidates)
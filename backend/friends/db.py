@@ -0,0 +1,100 @@
+"""Пул соединений с PostgreSQL, переживающий тёплые вызовы функции"""
+import os
+import threading
+import time
+import psycopg2
+from psycopg2 import extensions
+
+MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+ACQUIRE_TIMEOUT = float(os.environ.get('DB_POOL_ACQUIRE_TIMEOUT', '10'))
+HEALTH_CHECK_INTERVAL = float(os.environ.get('DB_POOL_HEALTH_CHECK_INTERVAL', '30'))
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Ограниченный пул: не больше max_size соединений, из них до max_idle ждут следующего вызова"""
+
+    def __init__(self, dsn: str, max_size: int = MAX_SIZE, max_idle: int = None,
+                 health_check_interval: float = HEALTH_CHECK_INTERVAL):
+        self.dsn = dsn
+        self.max_size = max_size
+        self.max_idle = max_size if max_idle is None else max_idle
+        self.health_check_interval = health_check_interval
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+
+    def getconn(self, timeout: float = ACQUIRE_TIMEOUT):
+        if not self._slots.acquire(timeout=timeout):
+            raise PoolExhausted(f'No free database connection within {timeout}s')
+        try:
+            while True:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    conn, released_at = self._idle.pop()
+                if self._is_healthy(conn, released_at):
+                    return conn
+                self._discard(conn)
+            return psycopg2.connect(self.dsn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn) -> None:
+        try:
+            if conn.closed:
+                return
+            if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    self._discard(conn)
+                    return
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append((conn, time.monotonic()))
+                    return
+            self._discard(conn)
+        finally:
+            self._slots.release()
+
+    def closeall(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def _is_healthy(self, conn, released_at: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - released_at < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _discard(conn) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+
+pool = ConnectionPool(os.environ.get('DATABASE_URL', ''))
+
+
+def acquire():
+    return pool.getconn()
+
+
+def release(conn) -> None:
+    pool.putconn(conn)
@@ -1,154 +1,165 @@
-import json
-import os
+import time
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import cache
+import metrics
+import router
+import serializer
+from router import response
+
+friends_cache = cache.TTLCache()
+app = router.Router('friends', default_actions={'GET': 'list'}, extra_headers=('If-None-Match',))
 
 def handler(event: dict, context) -> dict:
     """API для управления друзьями и приглашениями"""
-    method = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
+    return app.handle(event)
+
+@app.route('POST', 'add_by_username')
+def add_by_username(request, conn, cur) -> dict:
+    user_id = request.user_id
+    friend_username = request.body.get('friend_username', '').strip()
+    cur.execute("SELECT id FROM users WHERE username = %s", (friend_username,))
+    friend = cur.fetchone()
+    if not friend:
+        return response(404, {'error': 'User not found'})
+    friend_id = friend['id']
+    if friend_id == user_id:
+        return response(400, {'error': 'Cannot add yourself'})
+    try:
+        cur.execute(
+            "INSERT INTO friendships (user_id, friend_id, status) VALUES (%s, %s, 'pending')",
+            (user_id, friend_id)
+        )
+        conn.commit()
+        friends_cache.invalidate(('requests', friend_id))
+        return response(200, {'message': 'Friend request sent'})
+    except psycopg2.IntegrityError:
+        conn.rollback()
+        return response(400, {'error': 'Friend request already exists'})
+
+@app.route('POST', 'add_by_invite')
+def add_by_invite(request, conn, cur) -> dict:
+    user_id = request.user_id
+    invite_code = request.body.get('invite_code', '').strip()
+    cur.execute("SELECT id FROM users WHERE invite_code = %s", (invite_code,))
+    friend = cur.fetchone()
+    if not friend:
+        return response(404, {'error': 'Invalid invite code'})
+    friend_id = friend['id']
+    if friend_id == user_id:
+        return response(400, {'error': 'Cannot add yourself'})
     try:
-        if method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            action = body.get('action')
-            user_id = body.get('user_id')
-            
-            if action == 'add_by_username':
-                friend_username = body.get('friend_username', '').strip()
-                
-                cur.execute("SELECT id FROM users WHERE username = %s", (friend_username,))
-                friend = cur.fetchone()
-                
-                if not friend:
-                    return response(404, {'error': 'User not found'})
-                
-                friend_id = friend['id']
-                
-                if friend_id == user_id:
-                    return response(400, {'error': 'Cannot add yourself'})
-                
-                try:
-                    cur.execute(
-                        "INSERT INTO friendships (user_id, friend_id, status) VALUES (%s, %s, 'pending')",
-                        (user_id, friend_id)
-                    )
-                    conn.commit()
-                    return response(200, {'message': 'Friend request sent'})
-                except psycopg2.IntegrityError:
-                    conn.rollback()
-                    return response(400, {'error': 'Friend request already exists'})
-            
-            elif action == 'add_by_invite':
-                invite_code = body.get('invite_code', '').strip()
-                
-                cur.execute("SELECT id FROM users WHERE invite_code = %s", (invite_code,))
-                friend = cur.fetchone()
-                
-                if not friend:
-                    return response(404, {'error': 'Invalid invite code'})
-                
-                friend_id = friend['id']
-                
-                if friend_id == user_id:
-                    return response(400, {'error': 'Cannot add yourself'})
-                
-                try:
-                    cur.execute(
-                        "INSERT INTO friendships (user_id, friend_id, status) VALUES (%s, %s, 'accepted')",
-                        (user_id, friend_id)
-                    )
-                    cur.execute(
-                        "INSERT INTO friendships (user_id, friend_id, status) VALUES (%s, %s, 'accepted')",
-                        (friend_id, user_id)
-                    )
-                    conn.commit()
-                    return response(200, {'message': 'Friend added'})
-                except psycopg2.IntegrityError:
-                    conn.rollback()
-                    return response(400, {'error': 'Already friends'})
-            
-            elif action == 'accept':
-                friendship_id = body.get('friendship_id')
-                
-                cur.execute(
-                    "UPDATE friendships SET status = 'accepted' WHERE id = %s RETURNING user_id, friend_id",
-                    (friendship_id,)
-                )
-                friendship = cur.fetchone()
-                
-                if friendship:
-                    try:
-                        cur.execute(
-                            "INSERT INTO friendships (user_id, friend_id, status) VALUES (%s, %s, 'accepted')",
-                            (friendship['friend_id'], friendship['user_id'])
-                        )
-                    except psycopg2.IntegrityError:
-                        pass
-                    conn.commit()
-                return response(200, {'message': 'Friend request accepted'})
-            
-            elif action == 'reject':
-                friendship_id = body.get('friendship_id')
-                cur.execute("UPDATE friendships SET status = 'rejected' WHERE id = %s", (friendship_id,))
-                conn.commit()
-                return response(200, {'message': 'Friend request rejected'})
-        
-        elif method == 'GET':
-            query_params = event.get('queryStringParameters', {}) or {}
-            user_id = query_params.get('user_id')
-            action = query_params.get('action', 'list')
-            
-            if action == 'list':
-                cur.execute("""
-                    SELECT u.id, u.username, u.nickname, u.avatar_url, u.status, u.last_seen
-                    FROM users u
-                    INNER JOIN friendships f ON u.id = f.friend_id
-                    WHERE f.user_id = %s AND f.status = 'accepted'
-                    ORDER BY u.last_seen DESC
-                """, (user_id,))
-                friends = [dict(row) for row in cur.fetchall()]
-                return response(200, {'friends': friends})
-            
-            elif action == 'requests':
-                cur.execute("""
-                    SELECT f.id as friendship_id, u.id, u.username, u.nickname, u.avatar_url, f.created_at
-                    FROM users u
-                    INNER JOIN friendships f ON u.id = f.user_id
-                    WHERE f.friend_id = %s AND f.status = 'pending'
-                    ORDER BY f.created_at DESC
-                """, (user_id,))
-                requests = [dict(row) for row in cur.fetchall()]
-                return response(200, {'requests': requests})
-        
-        return response(405, {'error': 'Method not allowed'})
-    
-    finally:
-        cur.close()
-        conn.close()
+        cur.execute(
+            "INSERT INTO friendships (user_id, friend_id, status) VALUES (%s, %s, 'accepted')",
+            (user_id, friend_id)
+        )
+        cur.execute(
+            "INSERT INTO friendships (user_id, friend_id, status) VALUES (%s, %s, 'accepted')",
+            (friend_id, user_id)
+        )
+        conn.commit()
+        friends_cache.invalidate(('list', user_id), ('list', friend_id))
+        return response(200, {'message': 'Friend added'})
+    except psycopg2.IntegrityError:
+        conn.rollback()
+        return response(400, {'error': 'Already friends'})
+
+@app.route('POST', 'accept')
+def accept(request, conn, cur) -> dict:
+    friendship_id = friendship_id_from(request)
+    if friendship_id is None:
+        return response(400, {'error': 'friendship_id must be an integer'})
+    cur.execute("""
+        UPDATE friendships SET status = 'accepted'
+        WHERE id = %s AND friend_id = %s AND status = 'pending'
+        RETURNING user_id, friend_id
+    """, (friendship_id, request.user_id))
+    friendship = cur.fetchone()
+    if not friendship:
+        return response(404, {'error': 'Friend request not found'})
+    cur.execute(
+        "INSERT INTO friendships (user_id, friend_id, status) VALUES (%s, %s, 'accepted') ON CONFLICT (user_id, friend_id) DO UPDATE SET status = 'accepted'",
+        (friendship['friend_id'], friendship['user_id'])
+    )
+    conn.commit()
+    friends_cache.invalidate(
+        ('list', friendship['user_id']), ('list', friendship['friend_id']), ('requests', friendship['friend_id'])
+    )
+    return response(200, {'message': 'Friend request accepted'})
+
+@app.route('POST', 'reject')
+def reject(request, conn, cur) -> dict:
+    friendship_id = friendship_id_from(request)
+    if friendship_id is None:
+        return response(400, {'error': 'friendship_id must be an integer'})
+    cur.execute("""
+        UPDATE friendships SET status = 'rejected'
+        WHERE id = %s AND friend_id = %s AND status = 'pending'
+        RETURNING friend_id
+    """, (friendship_id, request.user_id))
+    friendship = cur.fetchone()
+    conn.commit()
+    if not friendship:
+        return response(404, {'error': 'Friend request not found'})
+    friends_cache.invalidate(('requests', friendship['friend_id']))
+    return response(200, {'message': 'Friend request rejected'})
 
-def response(status_code: int, data: dict) -> dict:
-    return {
-        'statusCode': status_code,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*'
-        },
-        'body': json.dumps(data, default=str),
-        'isBase64Encoded': False
+@app.route('GET', 'list')
+@app.route('GET', 'requests')
+def cached_list(request, conn, cur) -> dict:
+    key = (request.action, request.user_id)
+    (body, tag), hit = friends_cache.get_or_load(key, lambda: load_cached(cur, request.action, request.user_id))
+    return cached_response(request.event, body, tag, hit)
+
+@app.route('GET', 'cache_stats', with_db=False)
+def cache_stats(request) -> dict:
+    return response(200, friends_cache.stats())
+
+def load_cached(cur, action: str, user_id: int) -> tuple:
+    if action == 'list':
+        cur.execute("""
+            SELECT u.id, u.username, u.nickname, u.avatar_url,
+                CASE WHEN p.expires_at > CURRENT_TIMESTAMP THEN p.status ELSE 'offline' END as status,
+                u.last_seen
+            FROM users u
+            INNER JOIN friendships f ON u.id = f.friend_id
+            LEFT JOIN presence p ON p.user_id = u.id
+            WHERE f.user_id = %s AND f.status = 'accepted'
+            ORDER BY u.last_seen DESC
+        """, (user_id,))
+        data = {'friends': [dict(row) for row in cur.fetchall()]}
+    else:
+        cur.execute("""
+            SELECT f.id as friendship_id, u.id, u.username, u.nickname, u.avatar_url, f.created_at
+            FROM users u
+            INNER JOIN friendships f ON u.id = f.user_id
+            WHERE f.friend_id = %s AND f.status = 'pending'
+            ORDER BY f.created_at DESC
+        """, (user_id,))
+        data = {'requests': [dict(row) for row in cur.fetchall()]}
+    body = serializer.dumps(data)
+    return body, cache.etag(body)
+
+def cached_response(event: dict, body: bytes, tag: str, hit: bool) -> dict:
+    headers = {
+        **router.JSON_HEADERS,
+        'Access-Control-Expose-Headers': 'ETag, X-Cache',
+        'Cache-Control': 'private, no-cache',
+        'ETag': tag,
+        'X-Cache': 'HIT' if hit else 'MISS'
     }
+    if cache.not_modified(event, tag):
+        metrics.finish(304, 0, 0.0)
+        return {'statusCode': 304, 'headers': headers, 'body': '', 'isBase64Encoded': False}
+    started = time.perf_counter()
+    body, encoding, size = serializer.encode(body)
+    metrics.finish(200, size, time.perf_counter() - started)
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return {'statusCode': 200, 'headers': headers, 'body': body, 'isBase64Encoded': encoding is not None}
+
+def friendship_id_from(request):
+    try:
+        friendship_id = int(request.body.get('friendship_id'))
+    except (TypeError, ValueError):
+        return None
+    return friendship_id if 0 < friendship_id < 2 ** 31 else None
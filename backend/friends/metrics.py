@@ -0,0 +1,177 @@
+"""Инструментирование обработчиков: время и число SQL-запросов, строки, сериализация, размер ответа, холодный старт"""
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+from psycopg2.extras import RealDictCursor
+
+SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', '0.05'))
+SLOW_REQUEST_MS = float(os.environ.get('METRICS_SLOW_REQUEST_MS', '500'))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+MAX_LOGGED_STATEMENTS = 20
+COUNTERS = ('requests', 'errors', 'cold_starts', 'statements', 'rows', 'bytes')
+DURATIONS = ('seconds', 'sql_seconds', 'serialize_seconds')
+
+_local = threading.local()
+_lock = threading.Lock()
+_totals = {}
+_cold = True
+
+
+class Cursor(RealDictCursor):
+    """RealDictCursor, который считает запросы, их время и прочитанные строки текущего запроса"""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            _record_statement(query, time.perf_counter() - started)
+
+    def fetchone(self):
+        row = super().fetchone()
+        _record_rows(row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(size) if size is not None else super().fetchmany()
+        _record_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        _record_rows(len(rows))
+        return rows
+
+
+def start(function: str) -> None:
+    """Вызывается первой строкой handler; холодным считается первый запрос экземпляра"""
+    global _cold
+    with _lock:
+        cold, _cold = _cold, False
+    _local.request = {
+        'function': function,
+        'action': None,
+        'cold': cold,
+        'sampled': cold or random.random() < SAMPLE_RATE,
+        'started': time.perf_counter(),
+        'statements': 0,
+        'sql_seconds': 0.0,
+        'rows': 0,
+        'log': [],
+    }
+
+
+def action(name) -> None:
+    request = getattr(_local, 'request', None)
+    if request is not None:
+        request['action'] = name
+
+
+def current():
+    """Показатели текущего (или только что завершённого) запроса этого потока"""
+    return getattr(_local, 'request', None)
+
+
+def finish(status_code: int, body_bytes: int, serialize_seconds: float) -> None:
+    """Вызывается из response() или из Router при исключении: сводит показатели запроса в счётчики и пишет выборочный лог"""
+    request = getattr(_local, 'request', None)
+    if request is None or 'status' in request:
+        return
+    seconds = time.perf_counter() - request['started']
+    request.update(status=status_code, bytes=body_bytes, serialize_seconds=serialize_seconds, seconds=seconds)
+    key = (request['function'], request['action'] or 'none', f'{status_code // 100}xx')
+    with _lock:
+        totals = _totals.setdefault(key, dict.fromkeys(COUNTERS + DURATIONS, 0))
+        totals['requests'] += 1
+        totals['errors'] += status_code >= 500
+        totals['cold_starts'] += request['cold']
+        totals['statements'] += request['statements']
+        totals['rows'] += request['rows']
+        totals['bytes'] += body_bytes
+        totals['seconds'] += seconds
+        totals['sql_seconds'] += request['sql_seconds']
+        totals['serialize_seconds'] += serialize_seconds
+    if request['sampled'] or status_code >= 500 or seconds * 1000 >= SLOW_REQUEST_MS:
+        log(request)
+
+
+def log(request: dict) -> None:
+    record = {
+        'event': 'request',
+        'function': request['function'],
+        'action': request['action'],
+        'status': request['status'],
+        'cold': request['cold'],
+        'ms': round(request['seconds'] * 1000, 2),
+        'sql_ms': round(request['sql_seconds'] * 1000, 2),
+        'statements': request['statements'],
+        'rows': request['rows'],
+        'serialize_ms': round(request['serialize_seconds'] * 1000, 2),
+        'bytes': request['bytes'],
+    }
+    if request['log']:
+        record['sql'] = request['log']
+    print(json.dumps(record, ensure_ascii=False), file=sys.stdout, flush=True)
+
+
+def snapshot() -> dict:
+    with _lock:
+        return {key: dict(values) for key, values in _totals.items()}
+
+
+def exposition() -> str:
+    """Счётчики экземпляра в текстовом формате Prometheus"""
+    lines = []
+    totals = snapshot()
+    for name in COUNTERS + DURATIONS:
+        metric = f'moonly_{name}_total'
+        lines.append(f'# TYPE {metric} counter')
+        for (function, action_name, status), values in sorted(totals.items()):
+            labels = f'function="{function}",action="{action_name}",status="{status}"'
+            lines.append(f'{metric}{{{labels}}} {values[name]}')
+    return '\n'.join(lines) + '\n'
+
+
+def scrape(event: dict) -> dict:
+    """GET ?action=metrics: без METRICS_TOKEN счётчики не отдаются вовсе, с ним — только по X-Metrics-Token"""
+    if not METRICS_TOKEN:
+        return _error(404, 'Unknown action')
+    headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+    if not hmac.compare_digest(headers.get('x-metrics-token') or '', METRICS_TOKEN):
+        return _error(401, 'Invalid metrics token')
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'text/plain; version=0.0.4', 'Access-Control-Allow-Origin': '*'},
+        'body': exposition(),
+        'isBase64Encoded': False
+    }
+
+
+def _error(status_code: int, message: str) -> dict:
+    return {
+        'statusCode': status_code,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'error': message}),
+        'isBase64Encoded': False
+    }
+
+
+def _record_statement(query, seconds: float) -> None:
+    request = getattr(_local, 'request', None)
+    if request is None:
+        return
+    request['statements'] += 1
+    request['sql_seconds'] += seconds
+    if request['sampled'] and len(request['log']) < MAX_LOGGED_STATEMENTS:
+        text = query.decode() if isinstance(query, bytes) else str(query)
+        request['log'].append({'ms': round(seconds * 1000, 2), 'query': ' '.join(text.split())[:120]})
+
+
+def _record_rows(count: int) -> None:
+    request = getattr(_local, 'request', None)
+    if request is not None:
+        request['rows'] += count
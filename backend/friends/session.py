@@ -0,0 +1,58 @@
+"""Подписанные токены сессии: HMAC-SHA256 со сроком жизни и ротацией ключей, проверка без обращения к базе"""
+import base64
+import hashlib
+import hmac
+import os
+import time
+
+SESSION_TTL = int(os.environ.get('SESSION_TTL', str(30 * 24 * 3600)))
+
+
+def parse_keys(value: str) -> dict:
+    """SESSION_KEYS='kid1:secret1,kid2:secret2' — первым ключом подписываем, любым из списка проверяем"""
+    keys = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        kid, _, secret = item.partition(':')
+        if kid and secret:
+            keys[kid] = secret.encode()
+    return keys
+
+
+KEYS = parse_keys(os.environ.get('SESSION_KEYS', ''))
+
+
+def issue(user_id: int, now: float = None) -> str:
+    if not KEYS:
+        raise RuntimeError('SESSION_KEYS is not configured')
+    kid = next(iter(KEYS))
+    expires_at = int((now or time.time()) + SESSION_TTL)
+    payload = f'{kid}.{int(user_id)}.{expires_at}'
+    return f'{payload}.{_sign(KEYS[kid], payload)}'
+
+
+def verify(token: str, now: float = None):
+    """Возвращает user_id из действующего токена или None"""
+    try:
+        kid, user_id, expires_at, signature = token.split('.')
+        secret = KEYS[kid]
+        if not hmac.compare_digest(_sign(secret, f'{kid}.{user_id}.{expires_at}').encode(), signature.encode()):
+            return None
+        if int(expires_at) <= (now or time.time()):
+            return None
+        return int(user_id)
+    except (AttributeError, KeyError, ValueError):
+        return None
+
+
+def user_id_from(event: dict):
+    headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+    token = headers.get('x-session-token') or ''
+    authorization = headers.get('authorization') or ''
+    if not token and authorization[:7].lower() == 'bearer ':
+        token = authorization[7:].strip()
+    return verify(token) if token else None
+
+
+def _sign(secret: bytes, payload: str) -> str:
+    digest = hmac.new(secret, payload.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode().rstrip('=')
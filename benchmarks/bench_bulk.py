@@ -0,0 +1,108 @@
+"""Бенчмарк пакетных операций: создание больших групп и отправка альбомов
+
+Сравнивает прежний путь (INSERT на каждого участника, вызов send_message на каждое сообщение)
+с create_group одним запросом и send_messages. Запускать на отдельной базе с миграциями:
+
+    DATABASE_URL=postgresql://localhost/moonly_bench python benchmarks/bench_bulk.py --members 5000 --album 20
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from common import load_function, session_headers
+
+
+class CountingCursor(RealDictCursor):
+    statements = 0
+
+    def execute(self, query, vars=None):
+        CountingCursor.statements += 1
+        return super().execute(query, vars)
+
+
+def seed_users(conn, count: int) -> list:
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO users (username, nickname, password_hash, invite_code)
+        SELECT 'bench_bulk_' || n, 'Bench ' || n, '-', 'bench_bulk_' || n FROM generate_series(1, %s) n
+        ON CONFLICT (username) DO UPDATE SET nickname = EXCLUDED.nickname
+        RETURNING id
+    """, (count,))
+    ids = [row[0] for row in cur.fetchall()]
+    conn.commit()
+    return ids
+
+
+def legacy_create_group(conn, user_id: int, member_ids: list) -> int:
+    cur = conn.cursor(cursor_factory=CountingCursor)
+    cur.execute("INSERT INTO chats (name, is_group) VALUES (%s, TRUE) RETURNING id", ('bench legacy',))
+    chat_id = cur.fetchone()['id']
+    cur.execute("INSERT INTO chat_members (chat_id, user_id) VALUES (%s, %s)", (chat_id, user_id))
+    for member_id in member_ids:
+        cur.execute("INSERT INTO chat_members (chat_id, user_id) VALUES (%s, %s)", (chat_id, member_id))
+    conn.commit()
+    return chat_id
+
+
+def call(chats, body: dict) -> dict:
+    event = {'httpMethod': 'POST', 'body': json.dumps(body), 'headers': session_headers(chats, body['user_id'])}
+    result = chats.handler(event, None)
+    if result['statusCode'] != 200:
+        raise RuntimeError(f"Handler returned {result['statusCode']}: {result['body']}")
+    return json.loads(result['body'])
+
+
+def timed(run, repeat: int):
+    samples = []
+    CountingCursor.statements = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), CountingCursor.statements / repeat
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--members', type=int, default=1000)
+    parser.add_argument('--album', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    chats = load_function('chats')
+    chats.router.metrics.Cursor = CountingCursor
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    user_id, *member_ids = seed_users(conn, args.members + 1)
+
+    results = {
+        'create_group legacy': timed(lambda: legacy_create_group(conn, user_id, member_ids), args.repeat),
+        'create_group batched': timed(lambda: call(chats, {
+            'action': 'create_group', 'user_id': user_id, 'name': 'bench batched', 'member_ids': member_ids
+        }), args.repeat),
+    }
+    chat_id = call(chats, {'action': 'create_group', 'user_id': user_id, 'name': 'bench album', 'member_ids': []})['chat_id']
+    album = [
+        {'message_type': 'image', 'content': f'photo_{n}.jpg', 'file_url': f'https://example.invalid/{n}.jpg',
+         'file_name': f'photo_{n}.jpg', 'file_size': 100_000}
+        for n in range(args.album)
+    ]
+    results['album via send_message'] = timed(lambda: [
+        call(chats, {'action': 'send_message', 'user_id': user_id, 'chat_id': chat_id, **item}) for item in album
+    ], args.repeat)
+    results['album via send_messages'] = timed(lambda: call(chats, {
+        'action': 'send_messages', 'user_id': user_id, 'chat_id': chat_id, 'messages': album
+    }), args.repeat)
+
+    print(f'{args.members} members, album of {args.album}')
+    print(f"{'operation':<28}{'median ms':>11}{'statements':>12}")
+    for name, (median, statements) in results.items():
+        print(f'{name:<28}{median:>11.1f}{statements:>12.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Бенчмарк кеша друзей и членства: сколько чтений из базы снимает кеш и что дают ETag
+
+Запросы friends?action=list/requests и проверки членства в чате идут по случайным пользователям;
+каждая --write-every-я операция инвалидирует ключи, как это делают записи в друзьях и чатах:
+
+    DATABASE_URL=postgresql://localhost/moonly_bench python benchmarks/bench_cache.py --requests 2000 --users 50
+"""
+import argparse
+import os
+import random
+import time
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from common import load_function, percentile, session_headers
+
+
+class CountingCursor(RealDictCursor):
+    statements = 0
+
+    def execute(self, query, vars=None):
+        CountingCursor.statements += 1
+        return super().execute(query, vars)
+
+
+def load_workload(users: int) -> list:
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT u.id, (SELECT cm.chat_id FROM chat_members cm WHERE cm.user_id = u.id LIMIT 1)
+        FROM users u ORDER BY u.id LIMIT %s
+    """, (users,))
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+
+def run(friends, chats, cur, workload: list, requests: int, write_every: int, revalidate: bool, seed: int) -> dict:
+    rng = random.Random(seed)
+    etags = {}
+    samples = []
+    not_modified = 0
+    CountingCursor.statements = 0
+    for n in range(requests):
+        user_id, chat_id = rng.choice(workload)
+        headers = session_headers(friends, user_id)
+        if n % 3 == 2 and chat_id:
+            started = time.perf_counter()
+            chats.is_member(cur, user_id, chat_id)
+            samples.append((time.perf_counter() - started) * 1000)
+            continue
+        action = rng.choice(('list', 'requests'))
+        if revalidate and (action, user_id) in etags:
+            headers['If-None-Match'] = etags[(action, user_id)]
+        started = time.perf_counter()
+        result = friends.handler({'httpMethod': 'GET', 'queryStringParameters': {'action': action}, 'headers': headers}, None)
+        samples.append((time.perf_counter() - started) * 1000)
+        if result['statusCode'] == 304:
+            not_modified += 1
+        etags[(action, user_id)] = result['headers'].get('ETag')
+        if write_every and n % write_every == 0:
+            friends.friends_cache.invalidate(('list', user_id), ('requests', user_id))
+            chats.membership_cache.invalidate(user_id)
+    return {
+        'queries': CountingCursor.statements,
+        'p50': percentile(samples, 50),
+        'p99': percentile(samples, 99),
+        'not_modified': not_modified,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--write-every', type=int, default=50)
+    parser.add_argument('--ttl', type=float, default=15.0)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    friends = load_function('friends')
+    friends.router.metrics.Cursor = CountingCursor
+    chats = load_function('chats')
+    workload = load_workload(args.users)
+    if not workload:
+        raise SystemExit('No users in the database, seed it first')
+    cur = psycopg2.connect(os.environ['DATABASE_URL']).cursor(cursor_factory=CountingCursor)
+
+    results = {}
+    for mode, ttl, revalidate in (('no cache', 0, False), ('cache', args.ttl, False), ('cache + ETag', args.ttl, True)):
+        friends.friends_cache = friends.cache.TTLCache(ttl=ttl)
+        chats.membership_cache = chats.cache.TTLCache(ttl=ttl)
+        result = run(friends, chats, cur, workload, args.requests, args.write_every, revalidate, args.seed)
+        result['hit_ratio'] = friends.friends_cache.stats()['hit_ratio']
+        results[mode] = result
+
+    print(f'{args.requests} requests over {len(workload)} users, invalidation every {args.write_every}')
+    print(f"{'mode':<14}{'queries':>9}{'p50 ms':>9}{'p99 ms':>9}{'304s':>7}{'hit ratio':>11}")
+    for mode, result in results.items():
+        print(f"{mode:<14}{result['queries']:>9}{result['p50']:>9.3f}{result['p99']:>9.3f}"
+              f"{result['not_modified']:>7}{result['hit_ratio'] or 0:>11.2f}")
+
+
+if __name__ == '__main__':
+    main()
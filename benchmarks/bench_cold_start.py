@@ -0,0 +1,98 @@
+"""Бенчмарк холодного старта функций: время импорта index.py, первого и второго запроса в новом процессе
+
+Каждый замер идёт в отдельном интерпретаторе, как на новом экземпляре функции. Для files первый запрос
+presign создаёт клиент S3, поэтому в нём видно отложенный импорт boto3:
+
+    DATABASE_URL=postgresql://localhost/moonly_bench python benchmarks/bench_cold_start.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import types
+
+FIRST_REQUESTS = {
+    'auth': ('POST', {'action': 'heartbeat'}),
+    'friends': ('GET', {'action': 'list'}),
+    'chats': ('GET', {'action': 'list'}),
+    'events': ('GET', {'timeout': '0'}),
+    'files': ('POST', {'action': 'presign', 'file_name': 'cold.txt', 'file_type': 'text/plain'}),
+}
+HEAVY_MODULES = ('boto3', 'PIL.Image')
+
+
+def child(name: str, user_id: int) -> None:
+    """Выполняется в отдельном процессе и печатает JSON с замерами; до замера в процессе нет даже psycopg2"""
+    started = time.perf_counter()
+    from common import load_function, session_headers
+    function = load_function(name)
+    imported = time.perf_counter()
+    heavy = [module for module in HEAVY_MODULES if type(sys.modules.get(module)) is types.ModuleType]
+    method, params = FIRST_REQUESTS[name]
+    event = {'httpMethod': method, 'headers': session_headers(function, user_id)}
+    if method == 'GET':
+        event['queryStringParameters'] = params
+    else:
+        event['body'] = json.dumps(params)
+    timings = []
+    for _ in range(2):
+        request_started = time.perf_counter()
+        result = function.handler(event, None)
+        timings.append((time.perf_counter() - request_started) * 1000)
+        if result['statusCode'] != 200:
+            raise RuntimeError(f"{name} returned {result['statusCode']}: {result['body']}")
+    print(json.dumps({
+        'import_ms': (imported - started) * 1000,
+        'first_ms': timings[0],
+        'second_ms': timings[1],
+        'heavy_at_import': heavy,
+    }))
+
+
+def measure(name: str, user_id: int) -> dict:
+    env = {**os.environ, 'METRICS_SAMPLE_RATE': '0', 'METRICS_SLOW_REQUEST_MS': '1e9'}
+    env.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    env.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+    started = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', name, '--user-id', str(user_id)],
+        env=env, check=True, capture_output=True, text=True
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result['process_ms'] = (time.perf_counter() - started) * 1000
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--functions', default=','.join(FIRST_REQUESTS))
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--user-id', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.user_id)
+        return
+
+    import psycopg2
+    import seed
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    seed.seed(conn, 50, 3, 5)
+    user_id = seed.members(conn)[0]['user_id']
+    conn.close()
+
+    print(f"{'function':<10}{'import ms':>11}{'first ms':>10}{'second ms':>11}{'process ms':>12}  heavy at import")
+    for name in args.functions.split(','):
+        runs = [measure(name, user_id) for _ in range(args.runs)]
+        median = {key: statistics.median(run[key] for run in runs) for key in ('import_ms', 'first_ms', 'second_ms', 'process_ms')}
+        heavy = ', '.join(sorted({module for run in runs for module in run['heavy_at_import']})) or '-'
+        print(f"{name:<10}{median['import_ms']:>11.1f}{median['first_ms']:>10.1f}{median['second_ms']:>11.1f}"
+              f"{median['process_ms']:>12.1f}  {heavy}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Бенчмарк create_chat для пользователя с тысячами личных чатов: двойной self-join против ключа пары
+
+    DATABASE_URL=postgresql://localhost/moonly_bench python benchmarks/bench_direct_chat.py --chats 5000
+"""
+import argparse
+import os
+import statistics
+import time
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from common import load_function, percentile
+
+
+def seed(conn, chats: int, samples: int) -> tuple:
+    """Создаёт пользователя с chats личными чатами и запас собеседников для новых чатов"""
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO users (username, nickname, password_hash, invite_code)
+        SELECT 'bench_dc_' || n, 'Bench ' || n, '-', 'bench_dc_' || n FROM generate_series(0, %s) n
+        ON CONFLICT (username) DO UPDATE SET nickname = EXCLUDED.nickname
+        RETURNING id
+    """, (chats + 2 * samples,))
+    user_id, *peer_ids = sorted(row[0] for row in cur.fetchall())
+    existing = peer_ids[:chats]
+    cur.execute("""
+        WITH pairs AS (
+            SELECT LEAST(%s, peer_id) as min_user_id, GREATEST(%s, peer_id) as max_user_id
+            FROM unnest(%s::integer[]) peer_id
+        ), c AS (
+            INSERT INTO chats (is_group, min_user_id, max_user_id)
+            SELECT FALSE, min_user_id, max_user_id FROM pairs
+            ON CONFLICT (min_user_id, max_user_id) DO NOTHING
+            RETURNING id, min_user_id, max_user_id
+        )
+        INSERT INTO chat_members (chat_id, user_id)
+        SELECT c.id, member.user_id FROM c, unnest(ARRAY[c.min_user_id, c.max_user_id]) member(user_id)
+    """, (user_id, user_id, existing))
+    cur.execute("ANALYZE chats; ANALYZE chat_members")
+    conn.commit()
+    return user_id, existing, peer_ids[chats:]
+
+
+def legacy_create_chat(conn, user_id: int, friend_id: int) -> int:
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("""
+        SELECT c.id FROM chats c
+        INNER JOIN chat_members cm1 ON c.id = cm1.chat_id
+        INNER JOIN chat_members cm2 ON c.id = cm2.chat_id
+        WHERE c.is_group = FALSE
+        AND cm1.user_id = %s AND cm2.user_id = %s
+    """, (user_id, friend_id))
+    existing = cur.fetchone()
+    if existing:
+        conn.commit()
+        return existing['id']
+    cur.execute("INSERT INTO chats (is_group) VALUES (FALSE) RETURNING id")
+    chat_id = cur.fetchone()['id']
+    cur.execute("INSERT INTO chat_members (chat_id, user_id) VALUES (%s, %s)", (chat_id, user_id))
+    cur.execute("INSERT INTO chat_members (chat_id, user_id) VALUES (%s, %s)", (chat_id, friend_id))
+    conn.commit()
+    return chat_id
+
+
+def pair_key_create_chat(chats, conn, user_id: int, friend_id: int) -> int:
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    chat_id = chats.find_or_create_direct_chat(cur, user_id, friend_id)['id']
+    conn.commit()
+    return chat_id
+
+
+def timed(run, friend_ids: list) -> list:
+    samples = []
+    for friend_id in friend_ids:
+        started = time.perf_counter()
+        run(friend_id)
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chats', type=int, default=2000)
+    parser.add_argument('--samples', type=int, default=200)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    user_id, existing, fresh = seed(conn, args.chats, args.samples)
+    chats = load_function('chats')
+    step = max(1, len(existing) // args.samples)
+    existing_sample = existing[::step][:args.samples]
+    legacy_fresh, pair_fresh = fresh[:args.samples], fresh[args.samples:args.samples * 2]
+    results = {
+        'self-join, existing chat': timed(lambda friend_id: legacy_create_chat(conn, user_id, friend_id), existing_sample),
+        'self-join, new chat': timed(lambda friend_id: legacy_create_chat(conn, user_id, friend_id), legacy_fresh),
+        'pair key, existing chat': timed(lambda friend_id: pair_key_create_chat(chats, conn, user_id, friend_id), existing_sample),
+        'pair key, new chat': timed(lambda friend_id: pair_key_create_chat(chats, conn, user_id, friend_id), pair_fresh),
+    }
+
+    print(f'user with {args.chats} direct chats')
+    print(f"{'create_chat':<28}{'p50 ms':>9}{'p95 ms':>9}{'mean ms':>9}")
+    for name, samples in results.items():
+        print(f'{name:<28}{percentile(samples, 50):>9.3f}{percentile(samples, 95):>9.3f}{statistics.mean(samples):>9.3f}')
+
+
+if __name__ == '__main__':
+    main()
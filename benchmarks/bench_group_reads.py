@@ -0,0 +1,150 @@
+"""Бенчмарк большой группы: отправка, mark_read, подсчёт непрочитанных и квитанции о прочтении страницы
+
+Отправка через счётчик в chats сравнивается с обновлением строки каждого участника, непрочитанные из
+счётчиков — с прежним COUNT по сообщениям после маркера:
+
+    DATABASE_URL=postgresql://localhost/moonly_bench python benchmarks/bench_group_reads.py --members 5000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+
+import psycopg2
+
+from common import load_function, percentile, session_headers
+
+
+def seed(conn, members: int) -> tuple:
+    """Создаёт новую группу из members участников; пользователи переиспользуются между запусками"""
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO users (username, nickname, password_hash, invite_code)
+        SELECT 'bench_group_' || n, 'Bench ' || n, '-', 'bench_group_' || n FROM generate_series(1, %s) n
+        ON CONFLICT (username) DO UPDATE SET nickname = EXCLUDED.nickname
+        RETURNING id
+    """, (members,))
+    user_ids = sorted(row[0] for row in cur.fetchall())
+    cur.execute("""
+        WITH c AS (
+            INSERT INTO chats (name, is_group) VALUES ('Bench group', TRUE) RETURNING id
+        ), m AS (
+            INSERT INTO chat_members (chat_id, user_id) SELECT c.id, unnest(%s::integer[]) FROM c
+        )
+        SELECT id FROM c
+    """, (user_ids,))
+    chat_id = cur.fetchone()[0]
+    cur.execute("ANALYZE chat_members")
+    conn.commit()
+    return chat_id, user_ids
+
+
+def call(function, user_id: int, method: str, params: dict) -> dict:
+    event = {'httpMethod': method, 'headers': session_headers(function, user_id)}
+    if method == 'GET':
+        event['queryStringParameters'] = {key: str(value) for key, value in params.items()}
+    else:
+        event['body'] = json.dumps(params)
+    result = function.handler(event, None)
+    if result['statusCode'] != 200:
+        raise RuntimeError(f"{params.get('action')} returned {result['statusCode']}: {result['body']}")
+    return json.loads(result['body']) if not result['isBase64Encoded'] else {}
+
+
+def fan_out_send(conn, chat_id: int, sender_id: int) -> int:
+    """Счётчик непрочитанного в строке каждого участника: одна вставка и members - 1 обновлений.
+    Транзакция откатывается, чтобы не менять состояние группы для остальных замеров"""
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO messages (chat_id, sender_id, message_type, content) VALUES (%s, %s, 'text', 'fan-out')
+    """, (chat_id, sender_id))
+    cur.execute("""
+        UPDATE chat_members SET read_count = read_count - 1 WHERE chat_id = %s AND user_id != %s
+    """, (chat_id, sender_id))
+    conn.rollback()
+    return cur.rowcount
+
+
+def count_unread(conn, chat_id: int, user_id: int) -> int:
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT COUNT(*) FROM chat_members cm
+        INNER JOIN messages m ON m.chat_id = cm.chat_id AND m.id > cm.last_read_message_id AND m.sender_id != cm.user_id
+        WHERE cm.chat_id = %s AND cm.user_id = %s
+    """, (chat_id, user_id))
+    conn.commit()
+    return cur.fetchone()[0]
+
+
+def counter_unread(conn, chat_id: int, user_id: int) -> int:
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT GREATEST(c.message_count - cm.read_count, 0)
+        FROM chat_members cm INNER JOIN chats c ON c.id = cm.chat_id
+        WHERE cm.chat_id = %s AND cm.user_id = %s
+    """, (chat_id, user_id))
+    conn.commit()
+    return cur.fetchone()[0]
+
+
+def timed(run, items: list) -> list:
+    samples = []
+    for item in items:
+        started = time.perf_counter()
+        run(item)
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--members', type=int, default=5000)
+    parser.add_argument('--sends', type=int, default=200)
+    parser.add_argument('--reads', type=int, default=1000)
+    parser.add_argument('--page', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    chat_id, user_ids = seed(conn, args.members)
+    chats = load_function('chats')
+    senders = [rng.choice(user_ids) for _ in range(args.sends)]
+    message_ids = []
+
+    def send(sender_id: int) -> None:
+        message_ids.append(call(chats, sender_id, 'POST', {
+            'action': 'send_message', 'chat_id': chat_id, 'content': 'группа'
+        })['message']['id'])
+
+    results = {'send, chat counter': timed(send, senders)}
+    reads = [(rng.choice(user_ids), rng.choice(message_ids)) for _ in range(args.reads)]
+    results['mark_read'] = timed(lambda read: call(chats, read[0], 'POST', {
+        'action': 'mark_read', 'chat_id': chat_id, 'message_id': read[1]
+    }), reads)
+    lagging = rng.sample(user_ids, min(len(user_ids), 200))
+    results['unread, COUNT after marker'] = timed(lambda user_id: count_unread(conn, chat_id, user_id), lagging)
+    results['unread, counters'] = timed(lambda user_id: counter_unread(conn, chat_id, user_id), lagging)
+    page_ids = ','.join(str(message_id) for message_id in message_ids[-args.page:])
+    results[f'receipts, page of {args.page}'] = timed(lambda user_id: call(chats, user_id, 'GET', {
+        'action': 'receipts', 'chat_id': chat_id, 'message_ids': page_ids
+    }), lagging)
+
+    mismatched = sum(count_unread(conn, chat_id, user_id) != counter_unread(conn, chat_id, user_id) for user_id in lagging)
+    # Откаченные обновления оставляют members - 1 мёртвых версий строк на отправку, поэтому базовая линия идёт последней
+    fan_out_rows = []
+    results['send, per-member fan-out'] = timed(lambda sender_id: fan_out_rows.append(fan_out_send(conn, chat_id, sender_id)), senders)
+
+    print(f'group of {args.members} members, {args.sends} sends, {args.reads} mark_read')
+    print(f"{'operation':<30}{'p50 ms':>9}{'p95 ms':>9}{'mean ms':>9}{'ops/s':>9}")
+    for name, samples in results.items():
+        print(f'{name:<30}{percentile(samples, 50):>9.3f}{percentile(samples, 95):>9.3f}'
+              f'{statistics.mean(samples):>9.3f}{1000 / statistics.mean(samples):>9.0f}')
+    print(f'chat_members rows per send: counter 1, fan-out {statistics.mean(fan_out_rows):.0f}')
+    print(f'unread mismatches between COUNT and counters: {mismatched} of {len(lagging)}')
+
+
+if __name__ == '__main__':
+    main()
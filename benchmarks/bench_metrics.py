@@ -0,0 +1,70 @@
+"""Бенчмарк накладных расходов metrics.py: курсор со счётчиками против RealDictCursor и сводка запроса
+
+    DATABASE_URL=postgresql://localhost/moonly_bench python benchmarks/bench_metrics.py --seconds 2
+    DATABASE_URL=postgresql://localhost/moonly_bench METRICS_SAMPLE_RATE=1 python benchmarks/bench_metrics.py
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'chats'))
+
+import metrics  # noqa: E402
+
+
+def throughput(run, seconds: float) -> tuple:
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        run()
+        count += 1
+    elapsed = time.perf_counter() - started
+    return count / elapsed, elapsed * 1_000_000 / count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=2.0)
+    parser.add_argument('--rounds', type=int, default=5, help='варианты чередуются, берётся лучший раунд')
+    parser.add_argument('--rows', type=int, default=50, help='строк в ответе запроса')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    plain = conn.cursor(cursor_factory=RealDictCursor)
+    counted = conn.cursor(cursor_factory=metrics.Cursor)
+    query = 'SELECT n as id, md5(n::text) as content FROM generate_series(1, %s) n'
+
+    def select(cur):
+        cur.execute(query, (args.rows,))
+        cur.fetchall()
+
+    def request():
+        metrics.start('bench')
+        metrics.action('select')
+        select(counted)
+        metrics.finish(200, 1024, 0.0)
+
+    cases = {
+        'RealDictCursor': lambda: select(plain),
+        'metrics.Cursor': lambda: select(counted),
+        'start + query + finish': request,
+    }
+    print(f"{'operation':<24}{'ops/s':>12}{'us/op':>10}")
+    with contextlib.redirect_stdout(io.StringIO()) as logs:
+        rounds = [{name: throughput(run, args.seconds / args.rounds) for name, run in cases.items()} for _ in range(args.rounds)]
+    results = {name: max((result[name] for result in rounds), key=lambda value: value[0]) for name in cases}
+    for name, (per_second, latency) in results.items():
+        print(f'{name:<24}{per_second:>12.0f}{latency:>10.2f}')
+    overhead = results['metrics.Cursor'][1] - results['RealDictCursor'][1]
+    print(f'cursor overhead {overhead:.2f} us/query, '
+          f'{logs.getvalue().count(chr(10))} log lines at METRICS_SAMPLE_RATE={metrics.SAMPLE_RATE}')
+
+
+if __name__ == '__main__':
+    main()
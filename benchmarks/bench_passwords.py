@@ -0,0 +1,48 @@
+"""Бенчмарк пропускной способности входа на одно ядро при разной стоимости scrypt
+
+    python benchmarks/bench_passwords.py --costs 12,13,14,15,16 --seconds 2
+"""
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'auth'))
+
+import passwords  # noqa: E402
+
+
+def throughput(verify, seconds: float) -> tuple:
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        verify()
+        count += 1
+    elapsed = time.perf_counter() - started
+    return count / elapsed, elapsed * 1000 / count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--costs', default='12,13,14,15,16', help='log2(N) для scrypt через запятую')
+    parser.add_argument('--r', type=int, default=passwords.SCRYPT_R)
+    parser.add_argument('--p', type=int, default=passwords.SCRYPT_P)
+    parser.add_argument('--seconds', type=float, default=2.0)
+    args = parser.parse_args()
+
+    password = 'correct horse battery staple'
+    legacy = hashlib.sha256(password.encode()).hexdigest()
+    print(f"{'scheme':<26}{'memory MiB':>11}{'logins/s/core':>15}{'ms/login':>10}")
+    per_second, latency = throughput(lambda: passwords.verify_password(password, legacy), args.seconds)
+    print(f"{'sha256 (legacy)':<26}{0:>11.0f}{per_second:>15.0f}{latency:>10.3f}")
+    for cost in (int(value) for value in args.costs.split(',')):
+        n = 2 ** cost
+        stored = passwords.hash_password(password, n=n, r=args.r, p=args.p)
+        per_second, latency = throughput(lambda: passwords.verify_password(password, stored), args.seconds)
+        memory = 128 * args.r * (n + args.p) / 2 ** 20
+        print(f"{f'scrypt N=2^{cost} r={args.r} p={args.p}':<26}{memory:>11.0f}{per_second:>15.1f}{latency:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Бенчмарк задержки запросов: пул соединений против подключения на каждый запрос
+
+Запуск против локального PostgreSQL с применёнными миграциями:
+
+    DATABASE_URL=postgresql://localhost/moonly python benchmarks/bench_pool.py --requests 500
+"""
+import argparse
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import load_function, percentile, session_headers
+
+
+def run(handler, event: dict, requests: int, concurrency: int) -> list:
+    def timed_call(_):
+        started = time.perf_counter()
+        result = handler(event, None)
+        elapsed = time.perf_counter() - started
+        if result['statusCode'] != 200:
+            raise RuntimeError(f"Handler returned {result['statusCode']}: {result['body']}")
+        return elapsed * 1000
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(timed_call, range(requests)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--pool-size', type=int, default=4)
+    parser.add_argument('--user-id', type=int, default=1)
+    args = parser.parse_args()
+
+    dsn = os.environ['DATABASE_URL']
+    chats = load_function('chats')
+    db = chats.router.db
+    event = {
+        'httpMethod': 'GET',
+        'queryStringParameters': {'action': 'list'},
+        'headers': session_headers(chats, args.user_id),
+    }
+    modes = {
+        'connect-per-request': db.ConnectionPool(dsn, max_size=args.concurrency, max_idle=0),
+        'pooled': db.ConnectionPool(dsn, max_size=max(args.pool_size, args.concurrency)),
+    }
+
+    print(f"{'mode':<22}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+    for mode, pool in modes.items():
+        db.pool = pool
+        run(chats.handler, event, min(10, args.requests), args.concurrency)
+        samples = run(chats.handler, event, args.requests, args.concurrency)
+        pool.closeall()
+        print(f'{mode:<22}{percentile(samples, 50):>10.2f}{percentile(samples, 99):>10.2f}'
+              f'{statistics.mean(samples):>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
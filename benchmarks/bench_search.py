@@ -0,0 +1,144 @@
+"""Бенчмарк поиска по сообщениям: ILIKE '%term%' против полнотекстового индекса
+
+Заполняет базу синтетическим корпусом (используйте отдельную базу с применёнными миграциями):
+
+    DATABASE_URL=postgresql://localhost/moonly_bench python benchmarks/bench_search.py --messages 2000000
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from common import load_function, percentile
+
+SEED_BATCH = 200_000
+LEGACY_CHAT_QUERY = """
+    SELECT m.id, m.content, u.nickname, u.avatar_url
+    FROM messages m
+    INNER JOIN users u ON m.sender_id = u.id
+    WHERE m.chat_id = %s AND m.content ILIKE %s
+    ORDER BY m.created_at DESC
+    LIMIT 50
+"""
+LEGACY_GLOBAL_QUERY = """
+    SELECT m.id, m.content, u.nickname, u.avatar_url
+    FROM messages m
+    INNER JOIN users u ON m.sender_id = u.id
+    INNER JOIN chat_members cm ON cm.chat_id = m.chat_id AND cm.user_id = %s
+    WHERE m.content ILIKE %s
+    ORDER BY m.created_at DESC
+    LIMIT 50
+"""
+
+
+def vocabulary(size: int) -> list:
+    rng = random.Random(42)
+    consonants, vowels = 'бвгдзклмнпрстхш', 'аеиоуя'
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(consonants) + rng.choice(vowels) for _ in range(rng.randint(2, 4))))
+    return sorted(words, key=lambda word: (len(word), word))
+
+
+def seed(conn, messages: int, chats: int, words: list) -> int:
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO users (username, nickname, password_hash, invite_code)
+        VALUES ('bench_search', 'Bench Search', '-', 'bench_search')
+        ON CONFLICT (username) DO UPDATE SET nickname = EXCLUDED.nickname
+        RETURNING id
+    """)
+    user_id = cur.fetchone()[0]
+    cur.execute("""
+        WITH new_chats AS (
+            INSERT INTO chats (name, is_group) SELECT 'bench search ' || n, TRUE FROM generate_series(1, %s) n
+            RETURNING id
+        )
+        INSERT INTO chat_members (chat_id, user_id) SELECT id, %s FROM new_chats
+    """, (chats, user_id))
+    conn.commit()
+
+    cur.execute("""
+        SELECT cm.chat_id FROM chat_members cm INNER JOIN chats c ON c.id = cm.chat_id
+        WHERE cm.user_id = %s ORDER BY cm.chat_id DESC LIMIT %s
+    """, (user_id, chats))
+    chat_ids = [row[0] for row in cur.fetchall()]
+
+    for start in range(0, messages, SEED_BATCH):
+        count = min(SEED_BATCH, messages - start)
+        cur.execute("""
+            INSERT INTO messages (chat_id, sender_id, content)
+            SELECT (%(chats)s::int[])[1 + floor(power(random(), 1.5) * %(chat_count)s)::int],
+                %(user_id)s,
+                (SELECT string_agg((%(words)s::text[])[1 + floor(power(random(), 3) * %(word_count)s)::int], ' ')
+                 FROM generate_series(1, 4 + (n %% 12)))
+            FROM generate_series(1, %(count)s) n
+        """, {'chats': chat_ids, 'chat_count': len(chat_ids), 'user_id': user_id,
+              'words': words, 'word_count': len(words), 'count': count})
+        conn.commit()
+        print(f'seeded {start + count}/{messages}')
+    cur.execute('ANALYZE messages')
+    conn.commit()
+    return user_id
+
+
+def measure(run, runs: int) -> list:
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        run()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--vocabulary', type=int, default=20_000)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--skip-seed', action='store_true')
+    args = parser.parse_args()
+
+    chats = load_function('chats')
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    words = vocabulary(args.vocabulary)
+    if args.skip_seed:
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM users WHERE username = 'bench_search'")
+        user_id = cur.fetchone()[0]
+    else:
+        user_id = seed(conn, args.messages, args.chats, words)
+
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("""
+        SELECT m.chat_id, COUNT(*) as messages FROM messages m
+        INNER JOIN chat_members cm ON cm.chat_id = m.chat_id AND cm.user_id = %s
+        GROUP BY m.chat_id ORDER BY messages DESC LIMIT 1
+    """, (user_id,))
+    busiest = cur.fetchone()
+    print(f"busiest chat {busiest['chat_id']}: {busiest['messages']} messages")
+
+    terms = {'common': words[0], 'mid': words[len(words) // 50], 'rare': words[-1]}
+    print(f"{'query':<22}{'term':<10}{'ILIKE p50':>11}{'p95':>9}{'FTS p50':>10}{'p95':>9}")
+    for scope in ('chat', 'global'):
+        chat_id = busiest['chat_id'] if scope == 'chat' else None
+        for label, term in terms.items():
+            if chat_id:
+                legacy = lambda: cur.execute(LEGACY_CHAT_QUERY, (chat_id, f'%{term}%')) or cur.fetchall()
+            else:
+                legacy = lambda: cur.execute(LEGACY_GLOBAL_QUERY, (user_id, f'%{term}%')) or cur.fetchall()
+            indexed = lambda: chats.search_messages(cur, user_id, chat_id, term, 50, 0)
+            before = measure(legacy, args.runs)
+            after = measure(indexed, args.runs)
+            conn.rollback()
+            print(f'{scope + " " + label:<22}{term:<10}{statistics.median(before):>11.1f}{percentile(before, 95):>9.1f}'
+                  f'{statistics.median(after):>10.1f}{percentile(after, 95):>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
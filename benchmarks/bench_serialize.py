@@ -0,0 +1,100 @@
+"""Бенчмарк сериализации ответов: json.dumps(default=str) против orjson, компактного формата и gzip/brotli
+
+    python benchmarks/bench_serialize.py --messages 50 --chats 200 --seconds 1
+"""
+import argparse
+import datetime
+import gzip
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'chats'))
+
+import brotli  # noqa: E402
+import serializer  # noqa: E402
+
+WORDS = ('привет', 'как дела', 'встреча завтра в десять', 'отправил файл', 'созвонимся вечером', 'спасибо')
+
+
+def messages_page(count: int, senders: int, rng: random.Random) -> dict:
+    started = datetime.datetime(2024, 5, 1, 12, 0, 0)
+    messages = []
+    for n in range(count):
+        sender_id = 1000 + n % senders
+        is_image = n % 10 == 0
+        messages.append({
+            'id': 5_000_000 + n, 'chat_id': 42, 'sender_id': sender_id,
+            'message_type': 'image' if is_image else 'text',
+            'content': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 6))),
+            'file_url': f'https://cdn.example.invalid/files/{n:08x}.jpg' if is_image else None,
+            'file_name': f'{n}.jpg' if is_image else None,
+            'file_size': 150_000 + n if is_image else None,
+            'created_at': started + datetime.timedelta(seconds=37 * n, microseconds=n),
+            'nickname': f'Пользователь {sender_id}',
+            'avatar_url': f'https://cdn.example.invalid/avatars/{sender_id}.png',
+            'file_width': 1280 if is_image else None,
+            'file_height': 960 if is_image else None,
+            'previews': {'320': f'https://cdn.example.invalid/previews/{n:08x}-320.webp'} if is_image else None,
+        })
+    return {'messages': messages, 'has_more': True}
+
+
+def chat_list(count: int, rng: random.Random) -> dict:
+    started = datetime.datetime(2024, 5, 1, 12, 0, 0)
+    return {'chats': [{
+        'id': n, 'name': None, 'is_group': False, 'avatar_url': None, 'is_muted': False,
+        'unread': rng.randint(0, 5), 'last_message': rng.choice(WORDS),
+        'last_message_time': started - datetime.timedelta(minutes=n),
+        'display_name': f'Пользователь {n}', 'display_avatar': f'https://cdn.example.invalid/avatars/{n}.png',
+        'friend_status': rng.choice(('online', 'offline', 'away')),
+    } for n in range(count)]}
+
+
+def throughput(run, seconds: float) -> float:
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        run()
+        count += 1
+    return (time.perf_counter() - started) * 1_000_000 / count
+
+
+def variants(data: dict) -> dict:
+    return {
+        'json.dumps(default=str)': lambda: json.dumps(data, default=str).encode(),
+        'orjson': lambda: serializer.dumps(data),
+        'orjson compact': lambda: serializer.dumps(serializer.compact(data)),
+        'orjson + gzip': lambda: gzip.compress(serializer.dumps(data), serializer.GZIP_LEVEL),
+        'orjson + br': lambda: brotli.compress(serializer.dumps(data), quality=serializer.BROTLI_QUALITY),
+        'compact + br': lambda: brotli.compress(serializer.dumps(serializer.compact(data)), quality=serializer.BROTLI_QUALITY),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=50, help='сообщений на странице')
+    parser.add_argument('--senders', type=int, default=5, help='разных отправителей на странице')
+    parser.add_argument('--chats', type=int, default=200, help='чатов в списке')
+    parser.add_argument('--seconds', type=float, default=1.0)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    payloads = {
+        f'messages x{args.messages}': messages_page(args.messages, args.senders, rng),
+        f'chats x{args.chats}': chat_list(args.chats, rng),
+    }
+    for title, data in payloads.items():
+        print(title)
+        print(f"  {'variant':<26}{'bytes':>9}{'ratio':>8}{'us/op':>10}")
+        baseline = None
+        for name, run in variants(data).items():
+            size = len(run())
+            baseline = baseline or size
+            print(f'  {name:<26}{size:>9}{size / baseline:>8.2f}{throughput(run, args.seconds):>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
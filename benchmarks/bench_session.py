@@ -0,0 +1,61 @@
+"""Бенчмарк проверки токена сессии на запрос: HMAC в памяти против поиска пользователя в базе
+
+    python benchmarks/bench_session.py --seconds 2
+    DATABASE_URL=postgresql://localhost/moonly_bench python benchmarks/bench_session.py --seconds 2
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'auth'))
+os.environ.setdefault('SESSION_KEYS', 'bench:benchmark-only-secret,old:previous-secret')
+
+import session  # noqa: E402
+
+
+def throughput(run, seconds: float) -> tuple:
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        run()
+        count += 1
+    elapsed = time.perf_counter() - started
+    return count / elapsed, elapsed * 1_000_000 / count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=2.0)
+    parser.add_argument('--user-id', type=int, default=1)
+    args = parser.parse_args()
+
+    token = session.issue(args.user_id)
+    rotated = token.replace('bench.', 'old.', 1)
+    rotated = f"{rotated.rsplit('.', 1)[0]}.{session._sign(session.KEYS['old'], rotated.rsplit('.', 1)[0])}"
+    event = {'headers': {'Authorization': f'Bearer {token}'}}
+    cases = {
+        'issue': lambda: session.issue(args.user_id),
+        'verify': lambda: session.verify(token),
+        'verify rotated key': lambda: session.verify(rotated),
+        'verify forged': lambda: session.verify(token[:-2] + 'AA'),
+        'user_id_from(event)': lambda: session.user_id_from(event),
+    }
+    if os.environ.get('DATABASE_URL'):
+        import psycopg2
+        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        cur = conn.cursor()
+
+        def lookup():
+            cur.execute('SELECT id FROM users WHERE id = %s', (args.user_id,))
+            cur.fetchone()
+        cases['SELECT user by id'] = lookup
+
+    print(f"{'operation':<24}{'ops/s':>12}{'us/op':>10}")
+    for name, run in cases.items():
+        per_second, latency = throughput(run, args.seconds)
+        print(f'{name:<24}{per_second:>12.0f}{latency:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
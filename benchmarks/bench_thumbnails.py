@@ -0,0 +1,63 @@
+"""Бенчмарк пропускной способности построения превью на одно ядро
+
+    python benchmarks/bench_thumbnails.py --images 40 --size 4032x3024 --workers 1
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'files'))
+
+from PIL import Image, ImageFilter  # noqa: E402
+import thumbnails  # noqa: E402
+
+
+def synthetic_photo(width: int, height: int, pil_format: str, seed: int) -> bytes:
+    rng = random.Random(seed)
+    noise = Image.effect_noise((width // 8, height // 8), 64).convert('RGB')
+    tint = Image.new('RGB', noise.size, (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    image = Image.blend(noise, tint, 0.5).resize((width, height), Image.BICUBIC).filter(ImageFilter.SMOOTH)
+    buffer = io.BytesIO()
+    if pil_format == 'JPEG':
+        image.save(buffer, pil_format, quality=90)
+    else:
+        image.save(buffer, pil_format)
+    return buffer.getvalue()
+
+
+def process(data: bytes) -> int:
+    return sum(len(variant['data']) for variant in thumbnails.make_previews(data)['variants'])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--images', type=int, default=40)
+    parser.add_argument('--size', default='4032x3024')
+    parser.add_argument('--format', default='JPEG', choices=['JPEG', 'PNG', 'WEBP'])
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+
+    width, height = (int(side) for side in args.size.lower().split('x'))
+    sources = [synthetic_photo(width, height, args.format, seed) for seed in range(min(args.images, 8))]
+    batch = [sources[i % len(sources)] for i in range(args.images)]
+    source_bytes = sum(len(data) for data in batch)
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        list(executor.map(process, sources[:args.workers]))
+        started = time.perf_counter()
+        output_bytes = sum(executor.map(process, batch))
+        elapsed = time.perf_counter() - started
+
+    per_second = args.images / elapsed
+    print(f'{args.images} x {width}x{height} {args.format}, {args.workers} worker(s)')
+    print(f'images/s: {per_second:.1f}  per core: {per_second / args.workers:.1f}  '
+          f'ms/image/core: {elapsed * 1000 * args.workers / args.images:.1f}')
+    print(f'source MB: {source_bytes / 1e6:.1f}  previews MB: {output_bytes / 1e6:.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+"""Общие помощники бенчмарков: загрузка функций из backend/ и перцентили"""
+import importlib.util
+import os
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+SHARED_MODULES = ('cache', 'db', 'metrics', 'serializer', 'router', 'session', 'presence', 'passwords', 'thumbnails')
+
+os.environ.setdefault('SESSION_KEYS', 'bench:benchmark-only-secret')
+
+
+def load_function(name: str):
+    """Импортирует backend/<name>/index.py так, как его загружает платформа: со своим db.py рядом"""
+    function_dir = os.path.join(BACKEND_DIR, name)
+    for module in SHARED_MODULES:
+        sys.modules.pop(module, None)
+    sys.path.insert(0, function_dir)
+    try:
+        spec = importlib.util.spec_from_file_location(f'{name}_index', os.path.join(function_dir, 'index.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(function_dir)
+    return module
+
+
+def percentile(samples: list, pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def session_headers(function, user_id: int) -> dict:
+    return {'X-Session-Token': function.router.session.issue(user_id)}
@@ -0,0 +1,151 @@
+"""EXPLAIN ANALYZE всех запросов обработчиков на засеянной базе: ловит регрессии планов
+
+Скрипт засевает базу (см. seed.py), вызывает обработчики auth, friends, chats и events так, как их вызывает
+платформа, записывает каждый выполненный запрос и прогоняет его через EXPLAIN (ANALYZE, BUFFERS)
+в откатываемой транзакции. Seq Scan по большой таблице считается регрессией, и скрипт выходит с кодом 1.
+Запускать только на отдельной базе с миграциями:
+
+    DATABASE_URL=postgresql://localhost/moonly_bench python benchmarks/explain_queries.py --users 5000
+"""
+import argparse
+import json
+import os
+import re
+import sys
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+import seed
+from common import load_function, session_headers
+
+HOT_TABLES = ('users', 'friendships', 'chats', 'chat_members', 'messages')
+PARTITION_SUFFIX = re.compile(r'_(p\d+|default)$')
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+
+
+class RecordingCursor(RealDictCursor):
+    scenario = None
+    recorded = []
+
+    def execute(self, query, vars=None):
+        statement = self.mogrify(query, vars).decode()
+        if RecordingCursor.scenario and statement.lstrip().upper().startswith(EXPLAINABLE):
+            RecordingCursor.recorded.append((RecordingCursor.scenario, statement))
+        return super().execute(query, vars)
+
+
+def scenarios(conn) -> list:
+    row = next(member for member in seed.members(conn) if not member['is_group'])
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("""
+        SELECT u.username FROM users u
+        WHERE u.username LIKE %s AND u.id != %s AND NOT EXISTS (
+            SELECT 1 FROM friendships f
+            WHERE f.user_id = %s AND f.friend_id = u.id OR f.user_id = u.id AND f.friend_id = %s
+        )
+        LIMIT 1
+    """, (f'{seed.PREFIX}\\_%', row['user_id'], row['user_id'], row['user_id']))
+    stranger = cur.fetchone()['username']
+    user_id, chat_id, peer_id, last_id = row['user_id'], row['chat_id'], row['peer_id'], row['last_message_id']
+    message = {'content': 'план запроса', 'message_type': 'text'}
+    page_ids = ','.join(str(last_id - n) for n in range(20))
+    return [
+        ('auth', user_id, 'POST', {'action': 'heartbeat'}),
+        ('auth', user_id, 'POST', {'action': 'update_status', 'status': 'away'}),
+        ('auth', user_id, 'POST', {'action': 'update_profile', 'nickname': 'Plan'}),
+        ('friends', user_id, 'GET', {'action': 'list'}),
+        ('friends', user_id, 'GET', {'action': 'requests'}),
+        ('friends', user_id, 'POST', {'action': 'add_by_username', 'friend_username': stranger}),
+        ('chats', user_id, 'GET', {'action': 'list'}),
+        ('chats', user_id, 'GET', {'action': 'messages', 'chat_id': chat_id}),
+        ('chats', user_id, 'GET', {'action': 'messages', 'chat_id': chat_id, 'before_id': last_id}),
+        ('chats', user_id, 'GET', {'action': 'messages', 'chat_id': chat_id, 'after_id': last_id - 5}),
+        ('chats', user_id, 'GET', {'action': 'messages', 'chat_id': chat_id, 'search': 'встреча'}),
+        ('chats', user_id, 'GET', {'action': 'search', 'search': 'отпуск'}),
+        ('chats', user_id, 'GET', {'action': 'receipts', 'chat_id': chat_id, 'message_ids': page_ids}),
+        ('chats', user_id, 'POST', {'action': 'mark_read', 'chat_id': chat_id, 'message_id': last_id}),
+        ('chats', user_id, 'POST', {'action': 'create_chat', 'friend_id': peer_id}),
+        ('chats', user_id, 'POST', {'action': 'send_message', 'chat_id': chat_id, **message}),
+        ('chats', user_id, 'POST', {'action': 'send_messages', 'chat_id': chat_id, 'messages': [message] * 5}),
+        ('chats', user_id, 'POST', {'action': 'mute_chat', 'chat_id': chat_id, 'is_muted': False}),
+        ('events', user_id, 'GET', {}),
+        ('events', user_id, 'GET', {'after_id': last_id - 5, 'timeout': 0}),
+    ]
+
+
+def record(functions: dict, plan: list) -> list:
+    RecordingCursor.recorded = []
+    for name, user_id, method, params in plan:
+        function = functions[name]
+        event = {'httpMethod': method, 'headers': session_headers(function, user_id)}
+        if method == 'GET':
+            event['queryStringParameters'] = {key: str(value) for key, value in params.items()}
+        else:
+            event['body'] = json.dumps(params)
+        RecordingCursor.scenario = f"{name} {method} {params.get('action', 'poll')}"
+        result = function.handler(event, None)
+        RecordingCursor.scenario = None
+        if result['statusCode'] not in (200, 304):
+            raise RuntimeError(f"{name} {params} returned {result['statusCode']}: {result['body']}")
+    return RecordingCursor.recorded
+
+
+def seq_scans(node: dict, min_rows: int) -> list:
+    found = []
+    relation = PARTITION_SUFFIX.sub('', node.get('Relation Name', ''))
+    if node['Node Type'] == 'Seq Scan' and relation in HOT_TABLES:
+        rows = node.get('Actual Rows', 0) + node.get('Rows Removed by Filter', 0)
+        if rows >= min_rows:
+            found.append(f"{node['Relation Name']} ({rows} rows)")
+    for child in node.get('Plans', []):
+        found.extend(seq_scans(child, min_rows))
+    return found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--friends', type=int, default=10)
+    parser.add_argument('--messages', type=int, default=20, help='сообщений в каждом личном чате')
+    parser.add_argument('--min-rows', type=int, default=10000, help='Seq Scan по меньшему числу строк не считается регрессией')
+    parser.add_argument('--verbose', action='store_true', help='печатать планы целиком')
+    args = parser.parse_args()
+
+    os.environ.setdefault('CACHE_TTL', '0')
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    seed.seed(conn, args.users, args.friends, args.messages)
+    functions = {}
+    for name in ('auth', 'friends', 'chats', 'events'):
+        functions[name] = load_function(name)
+        functions[name].router.metrics.Cursor = RecordingCursor
+    recorded = record(functions, scenarios(conn))
+
+    cur = conn.cursor()
+    regressions = 0
+    print(f"{'scenario':<30}{'ms':>9}{'buffers':>9}  top node")
+    for scenario, statement in recorded:
+        try:
+            cur.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + statement)
+            explained = cur.fetchone()[0][0]
+        except psycopg2.Error as error:
+            print(f"{scenario:<30}  not replayable: {str(error).splitlines()[0]}")
+            continue
+        finally:
+            conn.rollback()
+        root = explained['Plan']
+        buffers = root.get('Shared Hit Blocks', 0) + root.get('Shared Read Blocks', 0)
+        scans = seq_scans(root, args.min_rows)
+        regressions += bool(scans)
+        print(f"{scenario:<30}{explained['Execution Time']:>9.2f}{buffers:>9}  {root['Node Type']}"
+              + (f"  SEQ SCAN: {', '.join(scans)}" if scans else ''))
+        if args.verbose or scans:
+            cur.execute('EXPLAIN ' + statement)
+            print('\n'.join('    ' + row[0] for row in cur.fetchall()))
+            conn.rollback()
+    print(f'{len(recorded)} queries, {regressions} with sequential scans of hot tables')
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
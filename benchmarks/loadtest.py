@@ -0,0 +1,218 @@
+"""Нагрузочный прогон настоящих обработчиков против локального PostgreSQL
+
+Засевает базу (см. seed.py), вызывает handler функций auth, friends, chats и events прямо в процессе
+из нескольких потоков и для каждого действия считает p50/p95/p99, запросы к базе (по счётчикам metrics.py)
+и строки ответа на один вызов. Результат сохраняется в JSON; с --baseline прогон сравнивается с прошлым
+и завершается с кодом 1 при регрессии:
+
+    DATABASE_URL=postgresql://localhost/moonly_bench python benchmarks/loadtest.py --requests 5000 --concurrency 8 --output run.json
+    DATABASE_URL=postgresql://localhost/moonly_bench python benchmarks/loadtest.py --baseline run.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+import seed
+from common import load_function, percentile, session_headers
+
+FUNCTIONS = ('auth', 'friends', 'chats', 'events')
+ACTIONS = {
+    'chats.list': 10,
+    'chats.messages': 25,
+    'chats.messages_older': 5,
+    'chats.search': 2,
+    'chats.send_message': 15,
+    'chats.mark_read': 10,
+    'chats.receipts': 5,
+    'friends.list': 5,
+    'friends.requests': 3,
+    'auth.heartbeat': 25,
+    'events.poll': 10,
+}
+
+
+def build_event(action: str, member: dict, rng: random.Random, headers: dict) -> tuple:
+    chat_id, last_id = member['chat_id'], member['last_message_id']
+    if action == 'chats.list':
+        return 'chats', {'httpMethod': 'GET', 'headers': headers, 'queryStringParameters': {'action': 'list'}}
+    if action == 'chats.messages':
+        params = {'action': 'messages', 'chat_id': str(chat_id)}
+        return 'chats', {'httpMethod': 'GET', 'headers': headers, 'queryStringParameters': params}
+    if action == 'chats.messages_older':
+        params = {'action': 'messages', 'chat_id': str(chat_id), 'before_id': str(last_id - rng.randint(0, 20))}
+        return 'chats', {'httpMethod': 'GET', 'headers': headers, 'queryStringParameters': params}
+    if action == 'chats.search':
+        params = {'action': 'search', 'search': rng.choice(seed.WORDS)}
+        return 'chats', {'httpMethod': 'GET', 'headers': headers, 'queryStringParameters': params}
+    if action == 'chats.send_message':
+        body = {'action': 'send_message', 'chat_id': chat_id, 'content': f'нагрузка {rng.random():.6f}'}
+        return 'chats', {'httpMethod': 'POST', 'headers': headers, 'body': json.dumps(body)}
+    if action == 'chats.mark_read':
+        body = {'action': 'mark_read', 'chat_id': chat_id, 'message_id': last_id}
+        return 'chats', {'httpMethod': 'POST', 'headers': headers, 'body': json.dumps(body)}
+    if action == 'chats.receipts':
+        params = {'action': 'receipts', 'chat_id': str(chat_id), 'message_ids': ','.join(str(last_id - n) for n in range(50))}
+        return 'chats', {'httpMethod': 'GET', 'headers': headers, 'queryStringParameters': params}
+    if action == 'friends.list':
+        return 'friends', {'httpMethod': 'GET', 'headers': headers, 'queryStringParameters': {'action': 'list'}}
+    if action == 'friends.requests':
+        return 'friends', {'httpMethod': 'GET', 'headers': headers, 'queryStringParameters': {'action': 'requests'}}
+    if action == 'auth.heartbeat':
+        return 'auth', {'httpMethod': 'POST', 'headers': headers, 'body': json.dumps({'action': 'heartbeat'})}
+    if action == 'events.poll':
+        params = {'after_id': str(last_id), 'timeout': '0'}
+        return 'events', {'httpMethod': 'GET', 'headers': headers, 'queryStringParameters': params}
+    raise ValueError(f'Unknown action {action}')
+
+
+def rows_in(result: dict) -> int:
+    if result['statusCode'] != 200 or not result.get('body'):
+        return 0
+    body = json.loads(result['body'])
+    return sum(len(value) for value in body.values() if isinstance(value, list))
+
+
+def run(functions: dict, members: list, mix: dict, requests: int, concurrency: int, seed_value: int) -> dict:
+    names, weights = list(mix), list(mix.values())
+    samples = {name: [] for name in names}
+    lock = threading.Lock()
+
+    def worker(index: int) -> None:
+        rng = random.Random(seed_value + index)
+        for _ in range(index, requests, concurrency):
+            action = rng.choices(names, weights)[0]
+            member = rng.choice(members)
+            headers = session_headers(functions['chats'], member['user_id'])
+            function, event = build_event(action, member, rng, headers)
+            started = time.perf_counter()
+            try:
+                result = functions[function].handler(event, None)
+                error = result['statusCode'] >= 400
+            except Exception:
+                result, error = {'statusCode': 500}, True
+            elapsed = (time.perf_counter() - started) * 1000
+            request = functions[function].router.metrics.current()
+            sample = (elapsed, request['statements'], rows_in(result), error, request['sql_seconds'] * 1000, request.get('bytes', 0))
+            with lock:
+                samples[action].append(sample)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+    wall = time.perf_counter() - started
+
+    actions = {}
+    for name, rows in samples.items():
+        if not rows:
+            continue
+        latencies = [row[0] for row in rows]
+        actions[name] = {
+            'requests': len(rows),
+            'errors': sum(row[3] for row in rows),
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'mean_ms': round(statistics.mean(latencies), 3),
+            'queries_per_request': round(statistics.mean(row[1] for row in rows), 2),
+            'rows_per_request': round(statistics.mean(row[2] for row in rows), 2),
+            'sql_ms_per_request': round(statistics.mean(row[4] for row in rows), 3),
+            'bytes_per_request': round(statistics.mean(row[5] for row in rows), 1),
+        }
+    total = [row[0] for rows in samples.values() for row in rows]
+    return {
+        'actions': actions,
+        'total': {
+            'requests': len(total),
+            'wall_s': round(wall, 3),
+            'throughput_rps': round(len(total) / wall, 1),
+            'p50_ms': round(percentile(total, 50), 3),
+            'p95_ms': round(percentile(total, 95), 3),
+            'p99_ms': round(percentile(total, 99), 3),
+        },
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """Регрессия: p95 вырос больше чем на tolerance, стало больше запросов к базе или появились ошибки"""
+    regressions = []
+    for name, current in result['actions'].items():
+        previous = baseline['actions'].get(name)
+        if not previous:
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous['p95_ms']} -> {current['p95_ms']} ms")
+        if current['queries_per_request'] > previous['queries_per_request'] + 0.01:
+            regressions.append(f"{name}: queries {previous['queries_per_request']} -> {current['queries_per_request']}")
+        if current['errors'] > previous['errors']:
+            regressions.append(f"{name}: errors {previous['errors']} -> {current['errors']}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--friends', type=int, default=10)
+    parser.add_argument('--messages', type=int, default=20, help='сообщений в каждом чате при засеве')
+    parser.add_argument('--groups', type=int, default=200)
+    parser.add_argument('--group-size', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--warmup', type=int, default=200)
+    parser.add_argument('--mix', default=None, help="веса действий JSON-объектом, например '{\"chats.list\": 1}'")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='куда сохранить результат в JSON')
+    parser.add_argument('--baseline', help='JSON прошлого прогона для сравнения')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='допустимый рост p95, доля')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DB_POOL_MAX_SIZE', str(args.concurrency))
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    seed.seed(conn, args.users, args.friends, args.messages, args.groups, args.group_size)
+    members = seed.members(conn)
+    conn.close()
+
+    functions = {}
+    for name in FUNCTIONS:
+        functions[name] = load_function(name)
+    mix = json.loads(args.mix) if args.mix else ACTIONS
+
+    run(functions, members, mix, args.warmup, args.concurrency, args.seed + 1000)
+    result = run(functions, members, mix, args.requests, args.concurrency, args.seed)
+    result['config'] = {
+        **{key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'mix': mix,
+        'python': platform.python_version(),
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+    print(f"{'action':<24}{'req':>6}{'err':>5}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}{'sql ms':>8}{'rows':>7}{'bytes':>8}")
+    for name, stats in sorted(result['actions'].items()):
+        print(f"{name:<24}{stats['requests']:>6}{stats['errors']:>5}{stats['p50_ms']:>9.2f}{stats['p95_ms']:>9.2f}"
+              f"{stats['p99_ms']:>9.2f}{stats['queries_per_request']:>9.2f}{stats['sql_ms_per_request']:>8.2f}"
+              f"{stats['rows_per_request']:>7.1f}{stats['bytes_per_request']:>8.0f}")
+    total = result['total']
+    print(f"total {total['requests']} requests in {total['wall_s']} s, {total['throughput_rps']} req/s, "
+          f"p50 {total['p50_ms']} / p95 {total['p95_ms']} / p99 {total['p99_ms']} ms")
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(result, output, indent=2, ensure_ascii=False)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(result, json.load(baseline), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
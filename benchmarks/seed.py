@@ -0,0 +1,151 @@
+"""Засев локальной базы для бенчмарков: пользователи, дружба, заявки, личные и групповые чаты, сообщения
+
+Повторный запуск с тем же префиксом ничего не делает. Можно вызывать отдельно:
+
+    DATABASE_URL=postgresql://localhost/moonly_bench python benchmarks/seed.py --users 5000 --friends 10 --messages 20
+"""
+import argparse
+import os
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+PREFIX = 'seed'
+WORDS = ('привет', 'как дела', 'встреча завтра', 'отправил файл', 'созвонимся вечером', 'спасибо', 'фото с отпуска')
+
+
+def seed(conn, users: int, friends: int, messages: int, groups: int = 0, group_size: int = 20) -> bool:
+    """Возвращает False, если база уже засеяна"""
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM users WHERE username = %s", (f'{PREFIX}_1',))
+    if cur.fetchone():
+        return False
+    cur.execute("""
+        INSERT INTO users (username, nickname, password_hash, invite_code)
+        SELECT %(prefix)s || '_' || n, 'User ' || n, '-', %(prefix)s || '_invite_' || n FROM generate_series(1, %(users)s) n
+    """, {'prefix': PREFIX, 'users': users})
+    cur.execute("""
+        CREATE TEMPORARY TABLE seeded_users ON COMMIT DROP AS
+        SELECT id, row_number() OVER (ORDER BY id) as n FROM users WHERE username LIKE %s
+    """, (f'{PREFIX}\\_%',))
+    cur.execute("""
+        WITH pairs AS (
+            SELECT a.id as user_id, b.id as friend_id
+            FROM seeded_users a INNER JOIN seeded_users b ON b.n BETWEEN a.n + 1 AND a.n + %s
+        )
+        INSERT INTO friendships (user_id, friend_id, status)
+        SELECT user_id, friend_id, 'accepted' FROM pairs
+        UNION ALL
+        SELECT friend_id, user_id, CASE WHEN (user_id + friend_id) %% 5 = 0 THEN 'pending' ELSE 'accepted' END FROM pairs
+    """, (friends,))
+    cur.execute("""
+        WITH c AS (
+            INSERT INTO chats (is_group, min_user_id, max_user_id)
+            SELECT FALSE, f.user_id, f.friend_id
+            FROM friendships f
+            INNER JOIN seeded_users u ON u.id = f.user_id
+            WHERE f.user_id < f.friend_id
+            ON CONFLICT (min_user_id, max_user_id) DO NOTHING
+            RETURNING id, min_user_id, max_user_id
+        )
+        INSERT INTO chat_members (chat_id, user_id)
+        SELECT c.id, member.user_id FROM c, unnest(ARRAY[c.min_user_id, c.max_user_id]) member(user_id)
+    """)
+    cur.execute("""
+        WITH g AS (
+            INSERT INTO chats (name, is_group)
+            SELECT 'Group ' || n, TRUE FROM generate_series(1, %s) n
+            RETURNING id
+        ), numbered AS (
+            SELECT id, row_number() OVER (ORDER BY id) as n FROM g
+        )
+        INSERT INTO chat_members (chat_id, user_id)
+        SELECT numbered.id, u.id
+        FROM numbered
+        INNER JOIN seeded_users u ON u.n BETWEEN numbered.n * 7 %% %s + 1 AND numbered.n * 7 %% %s + %s
+    """, (groups, users, users, group_size))
+    cur.execute("""
+        INSERT INTO messages (chat_id, sender_id, message_type, content, file_url, file_name, file_size, created_at)
+        SELECT members.chat_id, members.user_ids[1 + n %% array_length(members.user_ids, 1)],
+            CASE WHEN n %% 10 = 0 THEN 'image' ELSE 'text' END,
+            (%s::text[])[1 + (members.chat_id + n) %% %s] || ' ' || n,
+            CASE WHEN n %% 10 = 0 THEN 'https://example.invalid/' || members.chat_id || '/' || n || '.jpg' END,
+            CASE WHEN n %% 10 = 0 THEN n || '.jpg' END,
+            CASE WHEN n %% 10 = 0 THEN 100000 + n END,
+            CURRENT_TIMESTAMP - (%s - n) * INTERVAL '1 minute'
+        FROM (
+            SELECT cm.chat_id, array_agg(cm.user_id ORDER BY cm.user_id) as user_ids
+            FROM chat_members cm
+            INNER JOIN seeded_users u ON u.id = cm.user_id
+            GROUP BY cm.chat_id
+        ) members, generate_series(1, %s) n
+        ORDER BY n, members.chat_id
+    """, (list(WORDS), len(WORDS), messages, messages))
+    cur.execute("""
+        UPDATE chats c SET last_message_id = lm.id, last_message_at = lm.created_at, message_count = lm.n
+        FROM (
+            SELECT DISTINCT ON (chat_id) chat_id, id, created_at, COUNT(*) OVER (PARTITION BY chat_id) as n
+            FROM messages ORDER BY chat_id, id DESC
+        ) lm
+        WHERE lm.chat_id = c.id AND c.last_message_id IS DISTINCT FROM lm.id
+    """)
+    cur.execute("""
+        UPDATE chat_members cm SET last_read_message_id = COALESCE((
+            SELECT m.id FROM messages m WHERE m.chat_id = cm.chat_id ORDER BY m.id DESC OFFSET 3 LIMIT 1
+        ), 0)
+        FROM seeded_users u
+        WHERE u.id = cm.user_id
+    """)
+    cur.execute("""
+        UPDATE chat_members cm SET read_count = c.message_count - (
+            SELECT COUNT(*) FROM messages m
+            WHERE m.chat_id = cm.chat_id AND m.id > cm.last_read_message_id AND m.sender_id != cm.user_id
+        )
+        FROM chats c, seeded_users u
+        WHERE c.id = cm.chat_id AND u.id = cm.user_id
+    """)
+    cur.execute("""
+        INSERT INTO presence (user_id, status, expires_at)
+        SELECT id, 'online', CURRENT_TIMESTAMP + INTERVAL '1 hour' FROM seeded_users WHERE n % 3 = 0
+        ON CONFLICT (user_id) DO NOTHING
+    """)
+    conn.commit()
+    conn.autocommit = True
+    cur.execute("VACUUM ANALYZE")
+    conn.autocommit = False
+    return True
+
+
+def members(conn) -> list:
+    """Пары (пользователь, его чат) засеянных пользователей с собеседником и последним сообщением"""
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("""
+        SELECT cm.user_id, cm.chat_id, c.is_group, c.last_message_id,
+            CASE WHEN c.min_user_id = cm.user_id THEN c.max_user_id ELSE c.min_user_id END as peer_id
+        FROM users u
+        INNER JOIN chat_members cm ON cm.user_id = u.id
+        INNER JOIN chats c ON c.id = cm.chat_id
+        WHERE u.username LIKE %s AND c.last_message_id IS NOT NULL
+        ORDER BY cm.user_id, cm.chat_id
+    """, (f'{PREFIX}\\_%',))
+    return [dict(row) for row in cur.fetchall()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--friends', type=int, default=10)
+    parser.add_argument('--messages', type=int, default=20, help='сообщений в каждом чате')
+    parser.add_argument('--groups', type=int, default=0)
+    parser.add_argument('--group-size', type=int, default=20)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    if seed(conn, args.users, args.friends, args.messages, args.groups, args.group_size):
+        print('seeded')
+    else:
+        print('already seeded')
+
+
+if __name__ == '__main__':
+    main()
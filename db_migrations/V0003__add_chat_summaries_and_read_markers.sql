@@ -0,0 +1,20 @@
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS last_message_id INTEGER;
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS last_message_at TIMESTAMP;
+ALTER TABLE chat_members ADD COLUMN IF NOT EXISTS last_read_message_id INTEGER NOT NULL DEFAULT 0;
+
+UPDATE chats c
+SET last_message_id = lm.id, last_message_at = lm.created_at
+FROM (
+    SELECT DISTINCT ON (chat_id) chat_id, id, created_at
+    FROM messages
+    ORDER BY chat_id, id DESC
+) lm
+WHERE lm.chat_id = c.id;
+
+UPDATE chat_members cm
+SET last_read_message_id = COALESCE((
+    SELECT MAX(m.id) FROM messages m
+    WHERE m.chat_id = cm.chat_id AND m.created_at <= u.last_seen
+), 0)
+FROM users u
+WHERE u.id = cm.user_id;
@@ -0,0 +1,7 @@
+CREATE TABLE IF NOT EXISTS file_previews (
+    file_url TEXT PRIMARY KEY,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    variants JSONB NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
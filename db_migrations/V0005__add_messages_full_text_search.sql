@@ -0,0 +1,4 @@
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS content_tsv tsvector
+    GENERATED ALWAYS AS (to_tsvector('russian', COALESCE(content, ''))) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_messages_content_tsv ON messages USING GIN (content_tsv);
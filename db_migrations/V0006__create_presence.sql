@@ -0,0 +1,6 @@
+CREATE UNLOGGED TABLE IF NOT EXISTS presence (
+    user_id INTEGER PRIMARY KEY,
+    status VARCHAR(20) NOT NULL,
+    expires_at TIMESTAMP NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+) WITH (fillfactor = 50);
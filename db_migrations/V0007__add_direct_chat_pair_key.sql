@@ -0,0 +1,23 @@
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS min_user_id INTEGER REFERENCES users(id);
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS max_user_id INTEGER REFERENCES users(id);
+
+-- При дублях личных чатов ключ получает самый активный, остальные остаются без ключа и не теряются
+UPDATE chats c
+SET min_user_id = pair.min_user_id, max_user_id = pair.max_user_id
+FROM (
+    SELECT DISTINCT ON (p.min_user_id, p.max_user_id) p.chat_id, p.min_user_id, p.max_user_id
+    FROM (
+        SELECT cm.chat_id, MIN(cm.user_id) as min_user_id, MAX(cm.user_id) as max_user_id
+        FROM chat_members cm
+        INNER JOIN chats dc ON dc.id = cm.chat_id AND NOT dc.is_group
+        GROUP BY cm.chat_id
+        HAVING COUNT(*) = 2
+    ) p
+    INNER JOIN chats pc ON pc.id = p.chat_id
+    ORDER BY p.min_user_id, p.max_user_id, pc.last_message_at DESC NULLS LAST, pc.id
+) pair
+WHERE pair.chat_id = c.id;
+
+ALTER TABLE chats ADD CONSTRAINT chats_direct_pair_check
+    CHECK (min_user_id < max_user_id AND NOT is_group OR min_user_id IS NULL AND max_user_id IS NULL);
+ALTER TABLE chats ADD CONSTRAINT chats_direct_pair_key UNIQUE (min_user_id, max_user_id);
@@ -0,0 +1,20 @@
+-- Дубли UNIQUE-ограничений и индексы, покрытые составными
+DROP INDEX IF EXISTS idx_users_username;
+DROP INDEX IF EXISTS idx_users_invite_code;
+DROP INDEX IF EXISTS idx_friendships_user_id;
+DROP INDEX IF EXISTS idx_messages_chat_id;
+DROP INDEX IF EXISTS idx_messages_created_at;
+
+-- friends?action=list: друзья пользователя без чтения строк friendships
+CREATE INDEX IF NOT EXISTS idx_friendships_accepted ON friendships(user_id, friend_id) WHERE status = 'accepted';
+
+-- friends?action=requests: входящие заявки, уже отсортированные по времени
+CREATE INDEX IF NOT EXISTS idx_friendships_pending ON friendships(friend_id, created_at DESC) WHERE status = 'pending';
+
+-- Список чатов, проверка членства и события: чаты пользователя без обращения к таблице
+CREATE INDEX IF NOT EXISTS idx_chat_members_user_id_chat_id ON chat_members(user_id, chat_id);
+DROP INDEX IF EXISTS idx_chat_members_user_id;
+
+-- Лента, подсчёт непрочитанных (sender_id != читатель) и long-poll одним index-only scan
+CREATE INDEX IF NOT EXISTS idx_messages_chat_id_id_sender ON messages(chat_id, id) INCLUDE (sender_id);
+DROP INDEX IF EXISTS idx_messages_chat_id_id;
@@ -0,0 +1,57 @@
+-- messages становится секционированной по диапазонам id: постраничные запросы идут по (chat_id, id),
+-- поэтому отсечение секций работает без изменения запросов. Текущая таблица подключается первой секцией без копирования.
+ALTER TABLE messages RENAME TO messages_p0;
+ALTER TABLE messages_p0 RENAME CONSTRAINT messages_pkey TO messages_p0_pkey;
+ALTER INDEX idx_messages_chat_id_id_sender RENAME TO messages_p0_chat_id_id_sender_idx;
+ALTER INDEX idx_messages_content_tsv RENAME TO messages_p0_content_tsv_idx;
+
+CREATE TABLE messages (
+    id INTEGER NOT NULL DEFAULT nextval('messages_id_seq'),
+    chat_id INTEGER REFERENCES chats(id),
+    sender_id INTEGER REFERENCES users(id),
+    message_type VARCHAR(20) DEFAULT 'text',
+    content TEXT,
+    file_url TEXT,
+    file_name VARCHAR(255),
+    file_size INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    content_tsv tsvector GENERATED ALWAYS AS (to_tsvector('russian', COALESCE(content, ''))) STORED,
+    PRIMARY KEY (id)
+) PARTITION BY RANGE (id);
+
+ALTER SEQUENCE messages_id_seq OWNED BY messages.id;
+ALTER TABLE messages_p0 ALTER COLUMN id DROP DEFAULT;
+
+-- Первая секция заканчивается на ближайшей границе блока в 1 000 000 id, дальше заранее создаются ещё две;
+-- секция по умолчанию страхует вставки, если задание обслуживания давно не запускалось
+DO $$
+DECLARE
+    partition_size CONSTANT INTEGER := 1000000;
+    upper_bound INTEGER := (COALESCE((SELECT MAX(id) FROM messages_p0), 0) / partition_size + 1) * partition_size;
+BEGIN
+    EXECUTE format('ALTER TABLE messages ATTACH PARTITION messages_p0 FOR VALUES FROM (MINVALUE) TO (%s)', upper_bound);
+    FOR n IN 0..1 LOOP
+        EXECUTE format(
+            'CREATE TABLE messages_p%s PARTITION OF messages FOR VALUES FROM (%s) TO (%s)',
+            upper_bound + n * partition_size, upper_bound + n * partition_size, upper_bound + (n + 1) * partition_size
+        );
+    END LOOP;
+END $$;
+
+CREATE TABLE messages_default PARTITION OF messages DEFAULT;
+
+CREATE INDEX idx_messages_chat_id_id_sender ON messages(chat_id, id) INCLUDE (sender_id);
+CREATE INDEX idx_messages_content_tsv ON messages USING GIN (content_tsv);
+
+-- Архив холодных секций: сообщения чата пачками, JSON сжат gzip, поэтому TOAST не пытается сжимать повторно
+CREATE TABLE IF NOT EXISTS message_archive (
+    chat_id INTEGER NOT NULL,
+    min_id INTEGER NOT NULL,
+    max_id INTEGER NOT NULL,
+    message_count INTEGER NOT NULL,
+    last_content TEXT,
+    messages BYTEA NOT NULL,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (chat_id, max_id)
+);
+ALTER TABLE message_archive ALTER COLUMN messages SET STORAGE EXTERNAL;
@@ -0,0 +1,22 @@
+-- Непрочитанные считаются разницей двух счётчиков: сколько сообщений в чате всего и сколько из них
+-- участник прочёл. Отправка меняет одну строку chats, а не строку каждого участника группы
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS message_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE chat_members ADD COLUMN IF NOT EXISTS read_count INTEGER NOT NULL DEFAULT 0;
+
+-- Архивные сообщения тоже входят в счётчик: они выносятся из messages, но из чата не пропадают
+UPDATE chats c
+SET message_count = COALESCE((SELECT COUNT(*) FROM messages m WHERE m.chat_id = c.id), 0)
+    + COALESCE((SELECT SUM(a.message_count) FROM message_archive a WHERE a.chat_id = c.id), 0);
+
+-- Прочитанным считается всё, кроме чужих сообщений после маркера, как и в прежнем подсчёте непрочитанных
+UPDATE chat_members cm
+SET read_count = c.message_count
+    - (SELECT COUNT(*) FROM messages m
+       WHERE m.chat_id = cm.chat_id AND m.id > cm.last_read_message_id AND m.sender_id != cm.user_id)
+    - COALESCE((SELECT SUM(a.message_count) FROM message_archive a
+       WHERE a.chat_id = cm.chat_id AND a.min_id > cm.last_read_message_id), 0)
+FROM chats c
+WHERE c.id = cm.chat_id;
+
+-- Квитанции о прочтении ищут участников, чей маркер не ниже сообщения
+CREATE INDEX IF NOT EXISTS idx_chat_members_chat_id_last_read ON chat_members(chat_id, last_read_message_id);
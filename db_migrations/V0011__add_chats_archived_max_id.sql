@@ -0,0 +1,7 @@
+-- Последний id сообщения чата, ушедшего в message_archive: лента читает архив только у чатов, где он есть
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS archived_max_id INTEGER;
+
+UPDATE chats c
+SET archived_max_id = a.max_id
+FROM (SELECT chat_id, MAX(max_id) as max_id FROM message_archive GROUP BY chat_id) a
+WHERE a.chat_id = c.id;
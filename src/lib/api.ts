@@ -5,12 +5,78 @@ const API_URLS = {
   files: 'https://functions.poehali.dev/acff1539-24f6-47c3-a95e-c4dff347b866',
 };
 
+const UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024;
+const SESSION_TOKEN_KEY = 'moonly_token';
+
+let sessionToken = localStorage.getItem(SESSION_TOKEN_KEY);
+
+export const setSessionToken = (token: string | null) => {
+  sessionToken = token;
+  if (token) {
+    localStorage.setItem(SESSION_TOKEN_KEY, token);
+  } else {
+    localStorage.removeItem(SESSION_TOKEN_KEY);
+  }
+};
+
+export const hasSessionToken = () => Boolean(sessionToken);
+
+const sessionHeaders = (): Record<string, string> => (sessionToken ? { 'X-Session-Token': sessionToken } : {});
+
+const jsonHeaders = () => ({ 'Content-Type': 'application/json', ...sessionHeaders() });
+
+type CompactTable = { columns: string[]; rows: unknown[][] };
+type Row = Record<string, unknown>;
+
+const isCompactTable = (value: unknown): value is CompactTable =>
+  typeof value === 'object' && value !== null && 'columns' in value && 'rows' in value;
+
+const expandTable = ({ columns, rows }: CompactTable): Row[] =>
+  rows.map((row) => Object.fromEntries(columns.map((column, index) => [column, row[index]])));
+
+// format=compact: списки приходят колонками, профили отправителей сообщений — один раз в users
+const expandCompact = <T>(data: T): T => {
+  const body = data as Row;
+  if (body?.format !== 'compact') return data;
+  const users = (body.users || {}) as Record<string, Row>;
+  const expanded: Row = {};
+  for (const [key, value] of Object.entries(body)) {
+    if (key !== 'format' && key !== 'users') {
+      expanded[key] = isCompactTable(value) ? expandTable(value) : value;
+    }
+  }
+  if (Array.isArray(expanded.messages)) {
+    expanded.messages = (expanded.messages as Row[]).map((message) => ({
+      ...users[String(message.sender_id)],
+      ...message,
+    }));
+  }
+  return expanded as T;
+};
+
+const readBase64 = (blob: Blob) =>
+  new Promise<string>((resolve, reject) => {
+    const reader = new FileReader();
+    reader.onload = () => resolve((reader.result as string).split(',')[1] || '');
+    reader.onerror = reject;
+    reader.readAsDataURL(blob);
+  });
+
+const postFiles = async (payload: Record<string, unknown>) => {
+  const res = await fetch(API_URLS.files, {
+    method: 'POST',
+    headers: jsonHeaders(),
+    body: JSON.stringify(payload),
+  });
+  return res.json();
+};
+
 export const api = {
   auth: {
     register: async (username: string, nickname: string, password: string) => {
       const res = await fetch(API_URLS.auth, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: jsonHeaders(),
         body: JSON.stringify({ action: 'register', username, nickname, password }),
       });
       return res.json();
@@ -18,7 +84,7 @@ export const api = {
     login: async (username: string, password: string) => {
       const res = await fetch(API_URLS.auth, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: jsonHeaders(),
         body: JSON.stringify({ action: 'login', username, password }),
       });
       return res.json();
@@ -26,7 +92,7 @@ export const api = {
     logout: async (user_id: number) => {
       const res = await fetch(API_URLS.auth, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: jsonHeaders(),
         body: JSON.stringify({ action: 'logout', user_id }),
       });
       return res.json();
@@ -34,15 +100,23 @@ export const api = {
     updateStatus: async (user_id: number, status: string) => {
       const res = await fetch(API_URLS.auth, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: jsonHeaders(),
         body: JSON.stringify({ action: 'update_status', user_id, status }),
       });
       return res.json();
     },
+    heartbeat: async (user_id: number) => {
+      const res = await fetch(API_URLS.auth, {
+        method: 'POST',
+        headers: jsonHeaders(),
+        body: JSON.stringify({ action: 'heartbeat', user_id }),
+      });
+      return res.json();
+    },
     updateProfile: async (user_id: number, nickname: string, avatar_url?: string) => {
       const res = await fetch(API_URLS.auth, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: jsonHeaders(),
         body: JSON.stringify({ action: 'update_profile', user_id, nickname, avatar_url }),
       });
       return res.json();
@@ -50,17 +124,17 @@ export const api = {
   },
   friends: {
     list: async (user_id: number) => {
-      const res = await fetch(`${API_URLS.friends}?user_id=${user_id}&action=list`);
+      const res = await fetch(`${API_URLS.friends}?user_id=${user_id}&action=list`, { headers: sessionHeaders() });
       return res.json();
     },
     requests: async (user_id: number) => {
-      const res = await fetch(`${API_URLS.friends}?user_id=${user_id}&action=requests`);
+      const res = await fetch(`${API_URLS.friends}?user_id=${user_id}&action=requests`, { headers: sessionHeaders() });
       return res.json();
     },
     addByUsername: async (user_id: number, friend_username: string) => {
       const res = await fetch(API_URLS.friends, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: jsonHeaders(),
         body: JSON.stringify({ action: 'add_by_username', user_id, friend_username }),
       });
       return res.json();
@@ -68,7 +142,7 @@ export const api = {
     addByInvite: async (user_id: number, invite_code: string) => {
       const res = await fetch(API_URLS.friends, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: jsonHeaders(),
         body: JSON.stringify({ action: 'add_by_invite', user_id, invite_code }),
       });
       return res.json();
@@ -76,7 +150,7 @@ export const api = {
     accept: async (user_id: number, friendship_id: number) => {
       const res = await fetch(API_URLS.friends, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: jsonHeaders(),
         body: JSON.stringify({ action: 'accept', user_id, friendship_id }),
       });
       return res.json();
@@ -84,7 +158,7 @@ export const api = {
     reject: async (user_id: number, friendship_id: number) => {
       const res = await fetch(API_URLS.friends, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: jsonHeaders(),
         body: JSON.stringify({ action: 'reject', user_id, friendship_id }),
       });
       return res.json();
@@ -92,20 +166,45 @@ export const api = {
   },
   chats: {
     list: async (user_id: number) => {
-      const res = await fetch(`${API_URLS.chats}?user_id=${user_id}&action=list`);
-      return res.json();
+      const res = await fetch(`${API_URLS.chats}?user_id=${user_id}&action=list&format=compact`, {
+        headers: sessionHeaders(),
+      });
+      return expandCompact(await res.json());
     },
-    messages: async (user_id: number, chat_id: number, search?: string) => {
-      const url = search
-        ? `${API_URLS.chats}?user_id=${user_id}&action=messages&chat_id=${chat_id}&search=${encodeURIComponent(search)}`
-        : `${API_URLS.chats}?user_id=${user_id}&action=messages&chat_id=${chat_id}`;
-      const res = await fetch(url);
-      return res.json();
+    messages: async (
+      user_id: number,
+      chat_id: number,
+      search?: string,
+      page?: { before_id?: number; after_id?: number; limit?: number }
+    ) => {
+      const params = new URLSearchParams({
+        user_id: String(user_id),
+        action: 'messages',
+        chat_id: String(chat_id),
+        format: 'compact',
+      });
+      if (search) params.set('search', search);
+      if (page?.before_id) params.set('before_id', String(page.before_id));
+      if (page?.after_id) params.set('after_id', String(page.after_id));
+      if (page?.limit) params.set('limit', String(page.limit));
+      const res = await fetch(`${API_URLS.chats}?${params}`, { headers: sessionHeaders() });
+      return expandCompact(await res.json());
+    },
+    search: async (user_id: number, search: string, offset: number = 0) => {
+      const params = new URLSearchParams({
+        user_id: String(user_id),
+        action: 'search',
+        search,
+        offset: String(offset),
+        format: 'compact',
+      });
+      const res = await fetch(`${API_URLS.chats}?${params}`, { headers: sessionHeaders() });
+      return expandCompact(await res.json());
     },
     createChat: async (user_id: number, friend_id: number) => {
       const res = await fetch(API_URLS.chats, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: jsonHeaders(),
         body: JSON.stringify({ action: 'create_chat', user_id, friend_id }),
       });
       return res.json();
@@ -113,7 +212,7 @@ export const api = {
     createGroup: async (user_id: number, name: string, member_ids: number[]) => {
       const res = await fetch(API_URLS.chats, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: jsonHeaders(),
         body: JSON.stringify({ action: 'create_group', user_id, name, member_ids }),
       });
       return res.json();
@@ -129,7 +228,7 @@ export const api = {
     ) => {
       const res = await fetch(API_URLS.chats, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: jsonHeaders(),
         body: JSON.stringify({
           action: 'send_message',
           user_id,
@@ -143,10 +242,47 @@ export const api = {
       });
       return res.json();
     },
+    sendMessages: async (
+      user_id: number,
+      chat_id: number,
+      messages: {
+        content?: string;
+        message_type?: string;
+        file_url?: string;
+        file_name?: string;
+        file_size?: number;
+      }[]
+    ) => {
+      const res = await fetch(API_URLS.chats, {
+        method: 'POST',
+        headers: jsonHeaders(),
+        body: JSON.stringify({ action: 'send_messages', user_id, chat_id, messages }),
+      });
+      return res.json();
+    },
+    markRead: async (user_id: number, chat_id: number, message_id?: number) => {
+      const res = await fetch(API_URLS.chats, {
+        method: 'POST',
+        headers: jsonHeaders(),
+        body: JSON.stringify({ action: 'mark_read', user_id, chat_id, message_id }),
+      });
+      return res.json();
+    },
+    receipts: async (user_id: number, chat_id: number, message_ids: number[]) => {
+      const params = new URLSearchParams({
+        user_id: String(user_id),
+        action: 'receipts',
+        chat_id: String(chat_id),
+        message_ids: message_ids.join(','),
+        format: 'compact',
+      });
+      const res = await fetch(`${API_URLS.chats}?${params}`, { headers: sessionHeaders() });
+      return expandCompact(await res.json());
+    },
     muteChat: async (user_id: number, chat_id: number, is_muted: boolean) => {
       const res = await fetch(API_URLS.chats, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: jsonHeaders(),
         body: JSON.stringify({ action: 'mute_chat', user_id, chat_id, is_muted }),
       });
       return res.json();
@@ -154,29 +290,46 @@ export const api = {
   },
   files: {
     upload: async (file: File) => {
-      return new Promise((resolve, reject) => {
-        const reader = new FileReader();
-        reader.onload = async () => {
-          try {
-            const base64 = (reader.result as string).split(',')[1];
-            const res = await fetch(API_URLS.files, {
-              method: 'POST',
-              headers: { 'Content-Type': 'application/json' },
-              body: JSON.stringify({
-                file_data: base64,
-                file_name: file.name,
-                file_type: file.type,
-              }),
-            });
-            const data = await res.json();
-            resolve(data);
-          } catch (error) {
-            reject(error);
-          }
-        };
-        reader.onerror = reject;
-        reader.readAsDataURL(file);
+      if (file.size <= UPLOAD_CHUNK_SIZE) {
+        return postFiles({
+          file_data: await readBase64(file),
+          file_name: file.name,
+          file_type: file.type,
+        });
+      }
+
+      const upload = await postFiles({
+        action: 'multipart_start',
+        file_name: file.name,
+        file_type: file.type,
       });
+      if (upload.exists) return upload;
+      const partSize: number = upload.part_size || UPLOAD_CHUNK_SIZE;
+      try {
+        const parts = [];
+        for (let offset = 0, partNumber = 1; offset < file.size; offset += partSize, partNumber++) {
+          const part = await postFiles({
+            action: 'multipart_part',
+            key: upload.key,
+            upload_id: upload.upload_id,
+            part_number: partNumber,
+            file_data: await readBase64(file.slice(offset, offset + partSize)),
+          });
+          if (!part.etag) throw new Error(part.error || 'Part upload failed');
+          parts.push(part);
+        }
+        return postFiles({
+          action: 'multipart_complete',
+          key: upload.key,
+          upload_id: upload.upload_id,
+          file_name: file.name,
+          parts,
+        });
+      } catch (error) {
+        await postFiles({ action: 'multipart_abort', key: upload.key, upload_id: upload.upload_id });
+        throw error;
+      }
     },
+    previews: async (file_url: string) => postFiles({ action: 'previews', file_url }),
   },
 };
@@ -23,7 +23,7 @@ import {
   SelectValue,
 } from '@/components/ui/select';
 import { toast } from 'sonner';
-import { api } from '@/lib/api';
+import { api, hasSessionToken, setSessionToken } from '@/lib/api';
 import { WebRTCManager } from '@/lib/webrtc';
 
 type UserStatus = 'online' | 'offline' | 'dnd';
@@ -58,9 +58,22 @@ type Message = {
   message_type: string;
   file_url?: string;
   file_name?: string;
+  file_width?: number;
+  file_height?: number;
+  previews?: MessagePreview[];
   created_at: string;
 };
 
+type MessagePreview = {
+  name: string;
+  format: string;
+  url: string;
+  width: number;
+  height: number;
+};
+
+const HEARTBEAT_INTERVAL = 30_000;
+
 const Index = () => {
   const [isLoggedIn, setIsLoggedIn] = useState(false);
   const [isRegistering, setIsRegistering] = useState(false);
@@ -68,6 +81,8 @@ const Index = () => {
   const [chats, setChats] = useState<Chat[]>([]);
   const [selectedChat, setSelectedChat] = useState<Chat | null>(null);
   const [messages, setMessages] = useState<Message[]>([]);
+  const [hasOlderMessages, setHasOlderMessages] = useState(false);
+  const [isLoadingOlder, setIsLoadingOlder] = useState(false);
   const [messageInput, setMessageInput] = useState('');
   const [searchQuery, setSearchQuery] = useState('');
   const [messageSearchQuery, setMessageSearchQuery] = useState('');
@@ -85,7 +100,9 @@ const Index = () => {
 
   useEffect(() => {
     const savedUser = localStorage.getItem('moonly_user');
-    if (savedUser) {
+    if (savedUser && !hasSessionToken()) {
+      localStorage.removeItem('moonly_user');
+    } else if (savedUser) {
       const user = JSON.parse(savedUser);
       setCurrentUser(user);
       setIsLoggedIn(true);
@@ -94,6 +111,14 @@ const Index = () => {
     }
   }, []);
 
+  useEffect(() => {
+    if (!currentUser) return;
+    const sendHeartbeat = () => api.auth.heartbeat(currentUser.id).catch(() => undefined);
+    sendHeartbeat();
+    const timer = setInterval(sendHeartbeat, HEARTBEAT_INTERVAL);
+    return () => clearInterval(timer);
+  }, [currentUser?.id]);
+
   const loadChats = async (userId: number) => {
     try {
       const data = await api.chats.list(userId);
@@ -120,12 +145,31 @@ const Index = () => {
     if (!currentUser) return;
     try {
       const data = await api.chats.messages(currentUser.id, chatId, search);
-      setMessages(data.messages || []);
+      const loaded = data.messages || [];
+      setMessages(loaded);
+      setHasOlderMessages(!search && Boolean(data.has_more));
+      if (!search && loaded.length > 0) {
+        await api.chats.markRead(currentUser.id, chatId, loaded[loaded.length - 1].id);
+      }
     } catch (error) {
       console.error('Failed to load messages:', error);
     }
   };
 
+  const loadOlderMessages = async () => {
+    if (!currentUser || !selectedChat || messages.length === 0 || isLoadingOlder) return;
+    setIsLoadingOlder(true);
+    try {
+      const data = await api.chats.messages(currentUser.id, selectedChat.id, undefined, { before_id: messages[0].id });
+      setMessages((current) => [...(data.messages || []), ...current]);
+      setHasOlderMessages(Boolean(data.has_more));
+    } catch (error) {
+      toast.error('Не удалось загрузить сообщения');
+    } finally {
+      setIsLoadingOlder(false);
+    }
+  };
+
   const handleLogin = async (e: React.FormEvent<HTMLFormElement>) => {
     e.preventDefault();
     const formData = new FormData(e.currentTarget);
@@ -135,6 +179,7 @@ const Index = () => {
     try {
       const data = await api.auth.login(username, password);
       if (data.user) {
+        setSessionToken(data.token);
         setCurrentUser(data.user);
         setIsLoggedIn(true);
         localStorage.setItem('moonly_user', JSON.stringify(data.user));
@@ -159,6 +204,7 @@ const Index = () => {
     try {
       const data = await api.auth.register(username, nickname, password);
       if (data.user) {
+        setSessionToken(data.token);
         setCurrentUser(data.user);
         setIsLoggedIn(true);
         localStorage.setItem('moonly_user', JSON.stringify(data.user));
@@ -178,6 +224,7 @@ const Index = () => {
     }
     setCurrentUser(null);
     setIsLoggedIn(false);
+    setSessionToken(null);
     localStorage.removeItem('moonly_user');
     toast.info('Вы вышли из аккаунта');
   };
@@ -215,6 +262,9 @@ const Index = () => {
         data.file_name,
         data.file_size
       );
+      if (messageType === 'image') {
+        api.files.previews(data.file_url).catch(() => undefined);
+      }
       
       loadMessages(selectedChat.id);
       loadChats(currentUser.id);
@@ -778,6 +828,13 @@ const Index = () => {
 
           <ScrollArea className="flex-1 p-6">
             <div className="space-y-4">
+              {hasOlderMessages && (
+                <div className="flex justify-center">
+                  <Button variant="ghost" size="sm" onClick={loadOlderMessages} disabled={isLoadingOlder}>
+                    {isLoadingOlder ? 'Загрузка...' : 'Показать более ранние сообщения'}
+                  </Button>
+                </div>
+              )}
               {messages.map((message) => (
                 <div
                   key={message.id}
@@ -805,7 +862,28 @@ const Index = () => {
                       }`}
                     >
                       {message.message_type === 'image' && message.file_url && (
-                        <img src={message.file_url} alt={message.file_name} className="max-w-xs rounded" />
+                        <a href={message.file_url} target="_blank" rel="noopener noreferrer">
+                          <picture>
+                            {message.previews && (
+                              <source
+                                type="image/webp"
+                                sizes="320px"
+                                srcSet={message.previews
+                                  .filter((preview) => preview.format === 'webp')
+                                  .map((preview) => `${preview.url} ${preview.width}w`)
+                                  .join(', ')}
+                              />
+                            )}
+                            <img
+                              src={message.previews?.find((preview) => preview.name === 'thumb' && preview.format === 'jpeg')?.url || message.file_url}
+                              alt={message.file_name}
+                              width={message.file_width}
+                              height={message.file_height}
+                              loading="lazy"
+                              className="max-w-xs h-auto rounded"
+                            />
+                          </picture>
+                        </a>
                       )}
                       {message.message_type === 'voice' && message.file_url && (
                         <audio src={message.file_url} controls className="max-w-xs" />